@@ -1,5 +1,45 @@
-from . import dislocation
-from . import gb
-from .atoms import Atoms
-from .io import read
-from .relax import relax
+import importlib
+import sys
+import types
+
+# Submodules and the names exported from them are only imported on first
+# access, so importing atoms2d does not load ASE's file formats or SciPy.
+_submodules = ['dislocation', 'gb', 'io', 'kernels', 'neighbors',
+               'parallel', 'relax', 'sweep', 'trace']
+_exports = {'Atoms': 'atoms', 'read': 'io', 'relax': 'relax'}
+
+# The rest of the submodules are left out, so that a star import does not
+# load them and their dependencies
+__all__ = ['Atoms', 'dislocation', 'gb', 'io', 'read', 'relax']
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module('.' + _exports[name], __name__)
+        value = getattr(module, name)
+    elif name in _submodules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(
+            __name__, name))
+
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing the relax submodule binds it on the package, keep the
+        # relax function there instead.
+        if name in _exports and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+
+        super(_Package, self).__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
@@ -1,8 +1,52 @@
+import contextlib
+
 import ase
 import numpy as np
+from ase.data import atomic_numbers, chemical_symbols
+
+from . import private
+
+# Species classes of the elements
+OTHER = 0
+TM = 1
+DC = 2
+
+# Species class of each element by atomic number
+_species_table = np.zeros(len(chemical_symbols), dtype=np.int8)
+
+
+def set_species_class(symbol, species_class):
+    """Set the species class of an element to TM (transition metal), DC
+    (chalcogen) or OTHER.
+
+    Example:
+    set_species_class('Nb', TM)
+    set_species_class('Te', DC)
+    """
+    if species_class not in [OTHER, TM, DC]:
+        raise ValueError(str(species_class) + ' not supported')
+
+    _species_table[atomic_numbers[symbol]] = species_class
+
+
+for _symbol in ['Mo', 'W']:
+    set_species_class(_symbol, TM)
+
+for _symbol in ['S', 'Se']:
+    set_species_class(_symbol, DC)
+
+
+def species_classes(atoms):
+    """Return the species class of each atom of any ASE structure."""
+    return _species_table[atoms.numbers]
 
 
 class Atoms(ase.Atoms):
+    # Affine transform (matrix, offset) not yet applied to the positions, and
+    # whether transforms are being deferred
+    _transform = None
+    _deferring = False
+
     def __init__(self, symbols=None, positions=None, numbers=None, tags=None,
                  momenta=None, masses=None, magmoms=None, charges=None,
                  scaled_positions=None, cell=None, pbc=[1, 1, 0],
@@ -20,47 +64,129 @@ class Atoms(ase.Atoms):
 
     def copy(self):
         atoms = super(Atoms, self).copy()
-        atoms.lat_const = self.lat_const
+        atoms.lat_const = list(self.lat_const)
 
         return atoms
 
+    def tiled(self, repeats):
+        """Return a lazy view of the structure repeated as by atoms *=
+        repeats, which io.write_stream writes tile by tile."""
+        return Tiling(self, repeats)
+
+    @property
+    def arrays(self):
+        # Every access to the per-atom arrays, including ASE's own, first
+        # applies the deferred transform
+        if self._transform is not None:
+            self._apply_transform()
+
+        return self._arrays
+
+    @arrays.setter
+    def arrays(self, arrays):
+        self._arrays = arrays
+
+    @property
+    def species_classes(self):
+        """Array of the species class of each atom, TM, DC or OTHER.
+
+        The classes are looked up from the atomic numbers on every access,
+        which costs a single gather, so they always follow the numbers.
+        """
+        return species_classes(self)
+
+    def species_mask(self, species_class):
+        """Return a boolean mask of the atoms of a species class."""
+        return self.species_classes == species_class
+
+    def species_symbol(self, species_class):
+        """Return the element of the first atom of a species class, or an
+        empty string if there is none."""
+        index = np.flatnonzero(self.species_mask(species_class))
+
+        if len(index) == 0:
+            return ''
+
+        return chemical_symbols[self.numbers[index[0]]]
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """Compose the transforms made within the context into a single
+        affine transform, applied to the positions in one pass when they are
+        next read or on leaving the context.
+
+        Example:
+        with atoms.deferred():
+            atoms.rotate(30)
+            atoms.translate([1, 0, 0])
+            atoms.reflect(0)
+        """
+        self._deferring = True
+
+        try:
+            yield self
+        finally:
+            self._deferring = False
+
+            if self._transform is not None:
+                self._apply_transform()
+
+    def transform(self, matrix, offset=(0, 0, 0)):
+        """Replace each position p by matrix p + offset."""
+        matrix = np.asarray(matrix, dtype=float)
+        offset = np.asarray(offset, dtype=float)
+
+        if self._transform is not None:
+            previous, previous_offset = self._transform
+            matrix, offset = (matrix.dot(previous),
+                              matrix.dot(previous_offset) + offset)
+
+        self._transform = (matrix, offset)
+
+        if not self._deferring:
+            self._apply_transform()
+
+    def translate(self, displacement):
+        """Translate the positions by a vector, or by one vector per atom."""
+        displacement = np.asarray(displacement, dtype=float)
+
+        if displacement.ndim > 1:
+            self.positions += displacement
+        else:
+            self.transform(np.identity(3), np.broadcast_to(displacement, 3))
+
     def rotate(self, angle, center='COU', rotate_cell=False):
         """Rotate the whole cell about the z axis by the specified angle in
-        radians."""
-        super(Atoms, self).rotate(angle, 'z', center=center,
-                                  rotate_cell=rotate_cell)
+        degrees."""
+        center = self._centering_as_array(center)
+        c = np.cos(np.radians(angle))
+        s = np.sin(np.radians(angle))
+        matrix = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+        self.transform(matrix, center - matrix.dot(center))
+
+        if rotate_cell:
+            self.set_cell(self.cell[:].dot(matrix.T))
 
     def to_monolayer(self):
         """Convert bulk to monolayer."""
-        num_atoms = len(self.positions)
         cell_height = self.lat_const[2] / 2
 
         if cell_height == 0:
             cell_height = self.cell[2][2] / 2
 
         self.cell[2][2] = cell_height
-        i = 0
-
-        while i < num_atoms:
-            if self.positions[i][2] > cell_height:
-                self.pop(i)
-                num_atoms -= 1
-                i -= 1
-
-            i += 1
+        del self[np.flatnonzero(self.positions[:, 2] > cell_height)]
 
     def to_orthorhombic(self):
         """Make unit cell orthorhombic."""
-        for position in self.positions:
-            if position[0] < 1e-4:
-                multiplier = np.floor(abs(position[0]) / self.cell[0][0]) + 1
-                position[0] += multiplier * self.cell[0][0]
+        x = self.positions[:, 0]
+        width = self.cell[0][0]
 
-        # Repeat twice to be more consistent
-        for position in self.positions:
-            if position[0] < 1e-4:
-                multiplier = np.floor(abs(position[0]) / self.cell[0][0]) + 1
-                position[0] += multiplier * self.cell[0][0]
+        # Repeat twice to be more consistent, as atoms ending up just past
+        # zero are shifted again
+        for _ in range(2):
+            left = np.flatnonzero(x < 1e-4)
+            x[left] += (np.floor(np.abs(x[left]) / width) + 1) * width
 
         self.cell = [
             [self.cell[0][0], 0, 0],
@@ -70,67 +196,182 @@ class Atoms(ase.Atoms):
 
     def reflect(self, x=0, along='x'):
         """Reflect the whole cell about a given line."""
-        axis = 0
-
-        if along == 'y':
-            axis = 1
+        axis = private.axis_index(along)
+        matrix = np.identity(3)
+        matrix[axis, axis] = -1
+        offset = np.zeros(3)
+        offset[axis] = 2 * x
+        self.transform(matrix, offset)
 
-        for position in self.positions:
-            position[axis] = 2 * x - position[axis]
-
-        for vectors in self.cell:
-            vectors[axis] = 2 * x - vectors[axis]
+        self.cell[:, axis] = 2 * x - self.cell[:, axis]
 
     def remove_atoms(self, gt, lt, along='x'):
         """Cut atoms along the specified direction that are greater than and
         less than the specified values."""
-        num_atoms = len(self.positions)
-        i = 0
-        axis = 0
-
-        if along == 'y':
-            axis = 1
-        elif along == 'z':
-            axis = 2
-
-        while i < num_atoms:
-            if self.positions[i][axis] < lt and self.positions[i][axis] > gt:
-                self.pop(i)
-                num_atoms -= 1
-                i -= 1
-
-            i += 1
-
-    def replace_overlaps(self, gb_loc):
-        """Replace any overlapping atoms with their average position."""
-        num_atoms = len(self.positions)
+        self.remove_regions(slabs=[(gt, lt, along)])
+
+    def remove_regions(self, slabs=[], half_planes=[]):
+        """Remove the atoms lying inside any of the given regions in a single
+        pass.
+
+        Keyword arguments:
+        slabs -- list of (gt, lt, along) cuts, as taken by remove_atoms
+        half_planes -- list of (normal, offset) pairs, removing the atoms where
+                       the dot product of normal and position exceeds offset
+        """
+        remove = np.zeros(len(self), dtype=bool)
+
+        for gt, lt, along in slabs:
+            axis = private.axis_index(along)
+            remove |= ((self.positions[:, axis] > gt) &
+                       (self.positions[:, axis] < lt))
+
+        for normal, offset in half_planes:
+            normal = np.asarray(normal, dtype=float)
+            remove |= self.positions[:, :len(normal)].dot(normal) > offset
+
+        del self[np.flatnonzero(remove)]
+
+    def replace_overlaps(self, gb_loc, backend=None):
+        """Replace any overlapping atoms with their average position, using the
+        given kernel backend from atoms2d.kernels."""
+        # SciPy and the neighbor search are only needed here
+        import scipy.sparse
+        import scipy.sparse.csgraph
+
+        from . import neighbors
+
         lat_const = min(self.lat_const)
-        i = 0
-
-        while i < num_atoms:
-            pos1 = self.positions[i]
-            j = 0
-
-            if pos1[0] < gb_loc - lat_const or pos1[0] > gb_loc + lat_const:
-                i += 1
-                continue
-
-            while j < num_atoms:
-                pos2 = self.positions[j]
-                dx = pos2[0] - pos1[0]
-                dy = pos2[1] - pos1[1]
-                dz = pos2[2] - pos1[2]
-
-                if i != j and np.sqrt(dx*dx + dy*dy + dz*dz) < lat_const / 3:
-                    pos2[0] = (pos1[0] + pos2[0]) / 2
-                    pos2[1] = (pos1[1] + pos2[1]) / 2
-                    pos2[2] = (pos1[2] + pos2[2]) / 2
-                    self.pop(i)
-                    num_atoms -= 1
-                    i -= 1
-                    j -= 1
-                    break
-
-                j += 1
-
-            i += 1
+        cutoff = lat_const / 3
+        x = self.positions[:, 0]
+        window = (x >= gb_loc - lat_const) & (x <= gb_loc + lat_const)
+
+        # Only atoms near the window can overlap with the atoms inside it
+        nearby = np.flatnonzero((x >= gb_loc - lat_const - cutoff) &
+                                (x <= gb_loc + lat_const + cutoff))
+        i, j = neighbors.neighbor_pairs(self[nearby], cutoff,
+                                        same_plane=False, same_type=False,
+                                        backend=backend)
+        i, j = nearby[i], nearby[j]
+        overlap = window[i] | window[j]
+
+        if not overlap.any():
+            return
+
+        # Group chains of overlapping atoms into clusters
+        num_atoms = len(self)
+        num_clusters, cluster = scipy.sparse.csgraph.connected_components(
+            scipy.sparse.csr_matrix(
+                (np.ones(overlap.sum()), (i[overlap], j[overlap])),
+                shape=(num_atoms, num_atoms)))
+        size = np.bincount(cluster, minlength=num_clusters)
+
+        # Only atoms inside the window are removed. They collapse with the
+        # first atom of their cluster outside the window, or else with the
+        # last atom of the cluster, onto their average position. Any other
+        # atoms outside the window stay as they are.
+        indices = np.arange(num_atoms)
+        last = np.full(num_clusters, -1)
+        first_outside = np.full(num_clusters, num_atoms)
+        np.maximum.at(last, cluster, indices)
+        np.minimum.at(first_outside, cluster[~window], indices[~window])
+        keep = np.where(first_outside < num_atoms, first_outside, last)
+
+        merged = (size[cluster] > 1) & (window | (indices == keep[cluster]))
+        count = np.bincount(cluster[merged], minlength=num_clusters)
+        center = np.array([
+            np.bincount(cluster[merged],
+                        weights=self.positions[merged, axis],
+                        minlength=num_clusters)
+            for axis in range(3)
+        ]).T
+        collapsed = size > 1
+        self.positions[keep[collapsed]] = (center[collapsed] /
+                                           count[collapsed, None])
+
+        del self[indices[merged & (indices != keep[cluster])]]
+
+    def _apply_transform(self):
+        matrix, offset = self._transform
+        self._transform = None
+        positions = self._arrays['positions']
+        positions[:] = positions.dot(matrix.T) + offset
+
+
+class Tiling:
+    """Structure repeated along its cell vectors, without storing the
+    copies. Only the base structure is kept, and the tiles are generated in
+    the same order as atoms *= repeats when written.
+
+    Example:
+    io.write_stream('sheet.lmp', structure.tiled((40, 40, 1)))
+
+    Keyword arguments:
+    atoms -- base structure, copied
+    repeats -- number of copies along each cell vector
+    """
+    def __init__(self, atoms, repeats):
+        self.base = atoms.copy()
+        self.repeats = tuple(int(r) for r in repeats)
+
+        if len(self.repeats) != 3 or min(self.repeats) < 1:
+            raise ValueError(str(repeats) + ' not supported')
+
+    def __len__(self):
+        return len(self.base) * int(np.prod(self.repeats))
+
+    def get_cell(self):
+        return self.base.cell[:] * np.array(self.repeats)[:, None]
+
+    def get_pbc(self):
+        return self.base.get_pbc()
+
+    def bounds(self):
+        """Return the lowest and highest coordinates of the atoms."""
+        positions = self.base.positions
+        spans = (np.array(self.repeats)[:, None] - 1) * self.base.cell[:]
+
+        return (positions.min(axis=0) + np.minimum(spans, 0).sum(axis=0),
+                positions.max(axis=0) + np.maximum(spans, 0).sum(axis=0))
+
+    def composition(self):
+        """Return the number of atoms of each element."""
+        numbers, counts = np.unique(self.base.numbers, return_counts=True)
+        copies = int(np.prod(self.repeats))
+
+        return {chemical_symbols[n]: int(c) * copies
+                for n, c in zip(numbers, counts)}
+
+    def offsets(self):
+        """Return the displacement of each tile."""
+        tiles = np.indices(self.repeats).reshape(3, -1).T
+
+        return tiles.dot(self.base.cell[:])
+
+    def chunks(self, chunk_size=65536):
+        """Yield (positions, numbers) pairs of about chunk_size atoms, whole
+        tiles at a time unless a tile has more atoms than that."""
+        positions = self.base.positions
+        numbers = self.base.numbers
+        offsets = self.offsets()
+        num_atoms = len(self.base)
+
+        if num_atoms == 0:
+            return
+
+        tiles = max(chunk_size // num_atoms, 1)
+
+        for start in range(0, len(offsets), tiles):
+            group = offsets[start:start + tiles]
+
+            for i in range(0, num_atoms, chunk_size):
+                chunk = positions[i:i + chunk_size]
+                yield ((chunk[None] + group[:, None]).reshape(-1, 3),
+                       np.tile(numbers[i:i + chunk_size], len(group)))
+
+    def to_atoms(self):
+        """Return the tiled structure as a whole."""
+        atoms = self.base.copy()
+        atoms *= self.repeats
+
+        return atoms
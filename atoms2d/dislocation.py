@@ -4,16 +4,42 @@ import numpy as np
 
 from . import atoms
 from . import private
+from . import trace
 
+# Generated cores and lines, keyed on everything that determines them
+_templates = {}
 
+
+def clear_cache():
+    """Drop all the cached dislocation cores and lines."""
+    _templates.clear()
+
+
+@trace.traced
 def core(type, a, elements):
     """Generate a dislocation core.
 
+    The generated cores are cached, so later calls with the same arguments
+    only return a copy.
+
     Keyword arguments:
     type -- dislocation type (4|6, 5|7 or 6|8)
     a -- lattice constant
     elements -- array of elements with their symbols and z separation distance
     """
+    key = ('core', type, a, tuple((e['symbol'], e.get('distance'))
+                                  for e in elements))
+
+    if key not in _templates:
+        if type not in ['4|6', '5|7', '6|8']:
+            return _core(type, a, elements)
+
+        _templates[key] = _core(type, a, elements)
+
+    return _templates[key].copy()
+
+
+def _core(type, a, elements):
     positions = []
     symbols = []
     cell = [
@@ -81,27 +107,38 @@ def core(type, a, elements):
     return dislocation
 
 
+@trace.traced
 def line(type, primitive, rows, polarity=0):
     """Generate a line with a dislocation core.
 
+    The generated lines are cached, so later calls with the same arguments
+    only return a copy.
+
     Keyword arguments:
     type -- dislocation type (4|6, 5|7 or 6|8)
     primitive -- the primitive cell of the material
     rows -- number of rows for the dislocation line
     polarity -- either TM first (0) or DC first (1) (default 0)
     """
+    key = ('line', type, rows, polarity, primitive.positions.tobytes(),
+           primitive.numbers.tobytes(), primitive.cell[:].tobytes(),
+           tuple(primitive.lat_const))
+
+    if key not in _templates:
+        _templates[key] = _line(type, primitive, rows, polarity)
+
+    return _templates[key].copy()
+
+
+def _line(type, primitive, rows, polarity):
     disloc_line = primitive.copy()
     a = disloc_line.lat_const[0]
     disloc_line.to_monolayer()
-    symbols = set(disloc_line.get_chemical_symbols())
     elements = [{'symbol': '', 'distance': 0} for i in range(2)]
 
     # Store TM and DC symbols
-    for s in symbols:
-        if private.is_tm(s):
-            elements[0]['symbol'] = s
-        elif private.is_dc(s):
-            elements[1]['symbol'] = s
+    elements[0]['symbol'] = disloc_line.species_symbol(atoms.TM)
+    elements[1]['symbol'] = disloc_line.species_symbol(atoms.DC)
 
     # Get DC separation distance.
     high_dc = max(disloc_line.positions, key=lambda p: p[2])
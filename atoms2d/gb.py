@@ -5,6 +5,7 @@ from . import atoms
 from . import dislocation
 from . import io
 from . import private
+from . import trace
 
 
 def gb_distance(rows, lat_const):
@@ -18,60 +19,78 @@ def gb_angle(rows):
     return np.degrees(np.arcsin(1.0 / (np.sqrt(3) * (rows + 0.5))))
 
 
+@trace.traced
 def nr(cif, rows, columns, type, strain=0):
     """Generate a nanoribbon with a dislocation."""
-    angle = gb_angle(rows) / 2
-    tm = ''
-    dc = ''
-
     primitive = io.read(os.path.join(os.getcwd(), cif + '.cif'))
-    elements = set(primitive.get_chemical_symbols())
+
+    return _build_nr(_plan_nr(primitive, rows, columns, type), strain)
+
+
+@trace.traced
+def _plan_nr(primitive, rows, columns, type):
+    """Work out the parts of nr that do not depend on the strain."""
+    angle = gb_angle(rows) / 2
 
     # Store transition metal symbol and dichalcogenide symbol
-    for e in elements:
-        if tm == '' and (e == 'Mo' or e == 'W'):
-            tm = e
-        elif dc == '' and (e == 'S' or e == 'Se'):
-            dc = e
+    tm = primitive.species_symbol(atoms.TM)
 
+    trace.stage('repeat')
     gb = primitive.copy()
     gb *= (columns, 2 * rows, 1)
     gb.to_monolayer()
     gb.to_orthorhombic()
+    # Copy the cell vectors, as repeating the structure below updates the
+    # cell in place
     new_cell = [
-        gb.cell[0],
+        gb.cell[0].copy(),
         [0, gb_distance(rows, gb.lat_const[0]), 0],
-        gb.cell[2],
+        gb.cell[2].copy(),
     ]
     gb *= (3, 3, 1)
-    gb.rotate(angle)
-    gb.translate([-new_cell[0][0], -new_cell[1][1], 0])
-    gb.set_cell(new_cell)
-    gb.remove_atoms(-9999, 0)
-    gb.remove_atoms(new_cell[0][0], 9999)
-    gb.remove_atoms(-9999, 0, along='y')
-    gb.remove_atoms(new_cell[1][1], 9999, along='y')
+    trace.stage('rotate')
 
-    nearest_gb = sorted(gb.positions, key=lambda p: p[0], reverse=True)
+    with gb.deferred():
+        gb.rotate(angle)
+        gb.translate([-new_cell[0][0], -new_cell[1][1], 0])
 
-    for p in nearest_gb:
-        i = private.where(gb.positions, p)
-
-        if (gb.get_chemical_symbols()[i] == tm):
-            nearest_gb = p
-            break
+    trace.stage('crop')
+    gb.set_cell(new_cell)
+    gb.remove_regions(slabs=[
+        (-9999, 0, 'x'),
+        (new_cell[0][0], 9999, 'x'),
+        (-9999, 0, 'y'),
+        (new_cell[1][1], 9999, 'y'),
+    ])
 
-    gb.translate([gb.cell[0][0] - nearest_gb[0] + strain / 4, 0, 0])
+    nearest_gb = gb.positions[private.extreme_atom(gb, [tm], largest=True)]
 
+    trace.stage('dislocation line')
     disloc_line = dislocation.line(type, primitive, rows)
     top_tm = max(disloc_line.positions, key=lambda p: p[1])
     disloc_line.translate([gb.cell[0][0] - top_tm[0],
                            nearest_gb[1] - top_tm[1], 0])
 
+    return {
+        'gb': gb,
+        'nearest_gb': nearest_gb,
+        'disloc_line': disloc_line,
+    }
+
+
+@trace.traced
+def _build_nr(plan, strain):
+    """Build the structure of nr from its plan."""
+    trace.stage('shift')
+    gb = plan['gb'].copy()
+    gb.translate([gb.cell[0][0] - plan['nearest_gb'][0] + strain / 4, 0, 0])
+
+    trace.stage('wrap')
     gb.remove_atoms(gb.cell[0][0] - gb.lat_const[0] + strain / 4 + 0.1, 9999)
-    gb += disloc_line
+    gb += plan['disloc_line']
     gb.wrap(pbc=(0, 1, 0))
 
+    trace.stage('reflect')
     right = gb.copy()
     right.reflect(x=right.cell[0][0])
     gb += right
@@ -79,71 +98,50 @@ def nr(cif, rows, columns, type, strain=0):
     return gb
 
 
+@trace.traced
 def pbc_single(cif, rows, columns, type, strain=0, polarity=0):
     """Generate a grain boundary with a single dislocation and with periodic
     boundary condition."""
     primitive = io.read(os.path.join(os.getcwd(), cif + '.cif'))
+    plan = _plan_single(primitive, rows, columns, type, polarity)
 
+    return _build_single(plan, strain)
+
+
+@trace.traced
+def _plan_single(primitive, rows, columns, type, polarity=0):
+    """Work out the parts of pbc_single that do not depend on the strain,
+    without building the rotated strips."""
     # Create a strip
+    trace.stage('strip')
     strip = primitive.copy()
     strip.to_monolayer()
     strip *= (1, 2 * rows + 1, 1)
     strip.to_orthorhombic()
 
-    tm = ''
-    dc = ''
-    elements = set(primitive.get_chemical_symbols())
-
     # Store transition metal symbol and dichalcogenide symbol
-    for e in elements:
-        if tm == '' and (e == 'Mo' or e == 'W'):
-            tm = e
-        elif dc == '' and (e == 'S' or e == 'Se'):
-            dc = e
+    tm = primitive.species_symbol(atoms.TM)
+    dc = primitive.species_symbol(atoms.DC)
 
-    # Create a slowly rotating material from grain-boundary angle to 0.
     angle = gb_angle(rows) / 2
-    dangle = angle / (columns - 1)
-    lh = strip.copy()
-
-    sign = -1 if polarity == 0 else 1
-
-    for i in range(1, columns):
-        new_strip = strip.copy()
-        new_strip.rotate(-1 * i * dangle)
-        new_strip.translate((sign * i * new_strip.lat_const[0], 0, 0))
-        lh += new_strip
-
-    # Update the new cell size and move structure into the cell
-    cell_width = columns * primitive.lat_const[0]
-
-    if polarity == 0:
-        lh.translate([cell_width - lh.lat_const[0], 0, 0])
-    else:
-        lh.translate([-lh.lat_const[0] / 2 - cell_width, 0, 0])
-        lh.reflect(0)
-
-    lh.set_cell([
-        [cell_width, 0, 0],
-        lh.cell[1],
-        lh.cell[2]
-    ])
-
-    # Get the top most atom from the structure
-    if polarity != 0:
-        nearest_gb = sorted(lh.positions, key=lambda p: p[1], reverse=True)
-
-    # Get the left most atom from the structure
-    nearest_gb = sorted(lh.positions, key=lambda p: p[0])
-
+    plan = {
+        'strip': strip,
+        'lat_const': primitive.lat_const[0],
+        'columns': columns,
+        'polarity': polarity,
+        'dangle': angle / (columns - 1),
+        'cell_width': columns * primitive.lat_const[0],
+    }
+
+    # Get the left most atom from the structure. Only the atoms of that
+    # element are needed to find it.
     check = dc if polarity == 0 else tm
-    for p in nearest_gb:
-        i = private.where(lh.positions, p)
-
-        if (lh.get_chemical_symbols()[i] == check):
-            nearest_gb = p
-            break
+    candidates = _rotated_strips(
+        plan, strip[private.symbol_mask(strip, [check])])
+    nearest_gb = candidates.positions[private.extreme_atom(candidates,
+                                                           [check])]
 
+    trace.stage('dislocation line')
     disloc_line = dislocation.line(type, primitive, rows, polarity=polarity)
 
     # Get the bottom/top most atom from the dislocation line
@@ -174,22 +172,83 @@ def pbc_single(cif, rows, columns, type, strain=0, polarity=0):
     # Move the dislocation line to one lattice constant away from the bottom
     # atom of the original structure
     disloc_width = primitive.lat_const[0] * np.cos(np.radians(angle / 2))
-    dx = bottom_disloc[0] - nearest_gb[0]
     disloc_line.translate([-(disloc_width),
                            nearest_gb[1] - bottom_disloc[1], 0])
 
+    plan['disloc_line'] = disloc_line
+    plan['dx'] = bottom_disloc[0] - nearest_gb[0]
+
+    return plan
+
+
+def _rotated_strips(plan, strip):
+    """Return a slowly rotating material from grain-boundary angle to 0 made
+    of rotated copies of a strip, moved into the cell."""
+    a = plan['lat_const']
+    cell_width = plan['cell_width']
+    columns = plan['columns']
+    sign = -1 if plan['polarity'] == 0 else 1
+
+    # Rotate each copy about the center of the cell and shift it by one more
+    # lattice constant, all copies at once
+    angles = np.radians(-np.arange(columns) * plan['dangle'])
+    rotations = np.zeros((columns, 3, 3))
+    rotations[:, 0, 0] = rotations[:, 1, 1] = np.cos(angles)
+    rotations[:, 1, 0] = np.sin(angles)
+    rotations[:, 0, 1] = -rotations[:, 1, 0]
+    rotations[:, 2, 2] = 1
+    center = strip.cell[:].sum(axis=0) / 2
+    offsets = center - rotations.dot(center)
+    offsets[:, 0] += sign * np.arange(columns) * a
+
+    strips = private.Chunks(strip)
+
+    for _ in range(1, columns):
+        strips.add(strip)
+
+    lh = strips.join()
+    lh.positions = (np.einsum('cij,nj->cni', rotations, strip.positions) +
+                    offsets[:, None]).reshape(-1, 3)
+
+    if plan['polarity'] == 0:
+        lh.translate([cell_width - a, 0, 0])
+    else:
+        with lh.deferred():
+            lh.translate([-a / 2 - cell_width, 0, 0])
+            lh.reflect(0)
+
+    return lh
+
+
+@trace.traced
+def _build_single(plan, strain):
+    """Build the structure of pbc_single from its plan."""
+    trace.stage('rotate')
+
+    # The rotated strips do not depend on the strain, so keep them for the
+    # next build from the same plan
+    if 'strips' not in plan:
+        plan['strips'] = _rotated_strips(plan, plan['strip'])
+
+    lh = plan['strips'].copy()
+    dx = plan['dx']
+
     # Make cell from the center of the dislocation line to the right edge of
     # the original structure
     lh.set_cell([
-        [lh.cell[0][0] + dx - strain / 2, 0, 0], lh.cell[1], lh.cell[2]])
+        [plan['cell_width'] + dx - strain / 2, 0, 0], lh.cell[1], lh.cell[2]])
     lh.translate([dx - strain / 2, 0, 0])
 
+    trace.stage('reflect')
     left = lh.copy()
     left.reflect(0)
 
-    lh += disloc_line
-    lh += left
+    parts = private.Chunks(lh)
+    parts.add(plan['disloc_line'])
+    parts.add(left)
+    lh = parts.join()
 
+    trace.stage('crop')
     lh.translate([lh.cell[0][0], 0, 0])
     lh.set_cell([[2 * lh.cell[0][0], 0, 0], lh.cell[1], lh.cell[2]])
     lh.remove_atoms(lh.cell[0][0] - 0.01, 9999)
@@ -197,44 +256,54 @@ def pbc_single(cif, rows, columns, type, strain=0, polarity=0):
     return lh
 
 
+@trace.traced
 def pbc(cif, rows, columns, type, strain=0):
     """Generate a grain boundary with two dislocations of opposite polarity and
     with periodic boundary condition."""
     primitive = io.read(os.path.join(os.getcwd(), cif + '.cif'))
-    tm = ''
-    dc = ''
-    elements = set(primitive.get_chemical_symbols())
 
-    # Store transition metal symbol and dichalcogenide symbol
-    for e in elements:
-        if tm == '' and (e == 'Mo' or e == 'W'):
-            tm = e
-        elif dc == '' and (e == 'S' or e == 'Se'):
-            dc = e
+    return _build_pbc(_plan_pbc(primitive, rows, columns, type), strain)
+
+
+@trace.traced
+def _plan_pbc(primitive, rows, columns, type):
+    """Work out the parts of pbc that do not depend on the strain."""
+    plan = _plan_nr(primitive, rows, columns, type)
+
+    # Store dichalcogenide symbol
+    plan['dc'] = primitive.species_symbol(atoms.DC)
 
-    gb = nr(cif, rows, columns, type, strain)
+    trace.stage('dislocation line')
+    plan['pbc_line'] = dislocation.line(type, primitive.copy(), rows,
+                                        polarity=1)
 
-    nearest_gb = sorted(gb.positions, key=lambda p: p[0], reverse=True)
+    return plan
 
-    for p in nearest_gb:
-        i = private.where(gb.positions, p)
 
-        if (gb.get_chemical_symbols()[i] == dc):
-            nearest_gb = p
-            break
+@trace.traced
+def _build_pbc(plan, strain):
+    """Build the structure of pbc from its plan."""
+    gb = _build_nr(plan, strain)
 
-    disloc_line = dislocation.line(type, primitive.copy(), rows, polarity=1)
+    nearest_gb = gb.positions[private.extreme_atom(gb, [plan['dc']],
+                                                   largest=True)]
+
+    trace.stage('dislocation line')
+    disloc_line = plan['pbc_line'].copy()
     bottom_dc = min(disloc_line.positions, key=lambda p: p[1])
     disloc_line.translate([nearest_gb[0] - bottom_dc[0] - strain / 4,
                            nearest_gb[1] - bottom_dc[1], 0])
+    trace.stage('wrap')
     gb.remove_atoms(nearest_gb[0] - gb.lat_const[0] - strain / 4 + 0.1, 9999)
     gb += disloc_line
     gb.wrap(pbc=(0, 1, 0))
 
+    trace.stage('reflect')
     right = gb.copy()
     right.reflect(x=nearest_gb[0] - strain / 4)
     gb += right
 
+    trace.stage('crop')
     gb.set_cell([
         [(nearest_gb[0] - strain / 4 - gb.cell[0][0]) * 2, 0, 0],
         gb.cell[1],
@@ -242,12 +311,12 @@ def pbc(cif, rows, columns, type, strain=0):
     ])
 
     gb.translate([-gb.cell[0][0] / 4, 0, 0])
-    gb.remove_atoms(-9999, 0)
-    gb.remove_atoms(gb.cell[0][0], 9999)
+    gb.remove_regions(slabs=[(-9999, 0, 'x'), (gb.cell[0][0], 9999, 'x')])
 
     return gb
 
 
+@trace.traced
 def lh(A, B, rows, columns, type):
     """Generate a lateral heterostructure.
 
@@ -258,47 +327,50 @@ def lh(A, B, rows, columns, type):
     columns -- number of columns for both materials
     type -- dislocation type (4|6, 5|7 or 6|8)
     """
-    # Calculate the strain required to create the structure
-    A_test = pbc_single(A, rows, columns, type)
-    B_test = io.read(B + '.cif')
-    strain = A_test.cell[0][0] - 2 * (columns + 1) * B_test.lat_const[0]
-
-    A_top = pbc_single(A, rows, columns, type, polarity=1, strain=strain)
-    A_bottom = pbc_single(A, rows, columns, type, strain=strain)
+    trace.stage('strain')
+    A_primitive = io.read(os.path.join(os.getcwd(), A + '.cif'))
+    B_primitive = io.read(B + '.cif')
+
+    # Calculate the strain required to create the structure. Without strain,
+    # the cell of pbc_single is twice as wide as the rotated strips plus the
+    # gap to the dislocation line, so the plan is enough to know it.
+    plan = _plan_single(A_primitive, rows, columns, type, 0)
+    width = 2 * (plan['cell_width'] + plan['dx'])
+    strain = width - 2 * (columns + 1) * B_primitive.lat_const[0]
+
+    trace.stage('A')
+    A_top = _build_single(
+        _plan_single(A_primitive, rows, columns, type, 1), strain)
+    A_bottom = _build_single(plan, strain)
     A_bottom.translate([0, A_top.cell[1][1], 0])
-    structure = A_top.copy()
-    structure += A_bottom
-    structure.set_cell([
-        structure.cell[0],
-        structure.cell[1] * 2,
-        structure.cell[2]
-    ])
+    structure = private.Chunks(A_top)
+    structure.add(A_bottom)
+    cell = [A_top.cell[0], A_top.cell[1] * 2, A_top.cell[2]]
 
     dz = 0
 
     # Get A material TM z position
-    for i in range(len(A_top.positions)):
-        if (A_top.get_chemical_symbols()[i] == 'Mo' or
-                A_top.get_chemical_symbols()[i] == 'W'):
-            dz = A_top.positions[i][2]
-            break
+    tm = A_top.species_mask(atoms.TM)
 
-    B_top = io.read(B + '.cif')
-    B_top *= (2 * (columns + 1), 2 * rows, 1)
+    if tm.any():
+        dz = A_top.positions[tm][0][2]
+
+    trace.stage('B')
+    B_top = B_primitive
     B_top.to_monolayer()
+    B_top *= (2 * (columns + 1), 2 * rows, 1)
     B_top.to_orthorhombic()
     B_bottom = B_top.copy()
 
     # Get B material TM z position
-    for i in range(len(B_top.positions)):
-        if (B_top.get_chemical_symbols()[i] == 'Mo' or
-                B_top.get_chemical_symbols()[i] == 'W'):
-            dz -= B_top.positions[i][2]
-            break
+    tm = B_top.species_mask(atoms.TM)
+
+    if tm.any():
+        dz -= B_top.positions[tm][0][2]
 
     B_top.translate([
         -B_bottom.lat_const[0] / 2,
-        structure.cell[1][1],
+        cell[1][1],
         dz
     ])
     B_bottom.translate([
@@ -306,14 +378,58 @@ def lh(A, B, rows, columns, type):
         -B_bottom.cell[1][1],
         dz
     ])
-    structure += B_top
-    structure += B_bottom
+    trace.stage('assemble')
+    structure.add(B_top)
+    structure.add(B_bottom)
+    structure = structure.join()
 
     structure.translate([0, B_bottom.cell[1][1], 0])
     structure.set_cell([
-        structure.cell[0],
-        structure.cell[1] + B_bottom.cell[1] * 2,
-        structure.cell[2]
+        cell[0],
+        cell[1] + B_bottom.cell[1] * 2,
+        cell[2]
     ])
 
     return structure
+
+
+def strain_sweep(builder, strains, cif, rows, columns, type, **kwargs):
+    """Yield (strain, structure) pairs of a builder for several strains.
+
+    The parts of the structure that do not depend on the strain are built
+    once, then each strained variant only needs its own shifts, crops and
+    mirror image.
+
+    Example:
+    for strain, structure in gb.strain_sweep('pbc_single',
+                                             np.linspace(0, 1, 20),
+                                             'MoS2', 3, 4, '5|7'):
+        ...
+
+    Keyword arguments:
+    builder -- nr, pbc or pbc_single
+    strains -- iterable of strains
+    cif, rows, columns, type -- as taken by the builder
+    kwargs -- other keyword arguments of the builder, such as polarity
+    """
+    if builder not in _strain_builders:
+        raise ValueError(builder + ' not supported')
+
+    plan, build = _strain_builders[builder]
+
+    with trace.span('gb.strain_sweep'):
+        primitive = io.read(os.path.join(os.getcwd(), cif + '.cif'))
+        plan = plan(primitive, rows, columns, type, **kwargs)
+
+    for strain in strains:
+        with trace.span('gb.strain_sweep'):
+            structure = build(plan, strain)
+
+        yield strain, structure
+
+
+_strain_builders = {
+    'nr': (_plan_nr, _build_nr),
+    'pbc': (_plan_pbc, _build_pbc),
+    'pbc_single': (_plan_single, _build_single),
+}
@@ -1,10 +1,191 @@
+import collections
+import concurrent.futures
+import hashlib
+import os
+
 import ase.io
 import numpy as np
+from ase.data import atomic_masses, atomic_numbers, chemical_symbols
+
+from . import trace
+from .atoms import Atoms, Tiling
+
+# Number of parsed structures kept in memory by read()
+cache_size = 32
+
+# Directory for compact copies of parsed structures, disabled when None
+cache_dir = None
+
+_cache = collections.OrderedDict()
+
+
+@trace.traced
+def read(file, cache=True):
+    """Read a structure file.
+
+    Files ending in .npz are read as the compact format written by write(),
+    any other file with ASE.
+
+    Parsed structures are cached by path and modification time, so reading
+    the same unchanged file again only returns a copy. The least recently
+    read structures are dropped once there are more than cache_size of them.
+    If cache_dir is set, parsed structures are also stored there as npz
+    files and reused by later processes.
+    """
+    if not cache:
+        return _parse(file)
+
+    key = _key(file)
+    atoms = _lookup(key)
+
+    if atoms is None:
+        atoms = _parse(file)
+        _store(key, atoms, parsed=True)
+    else:
+        _store(key, atoms)
+
+    return atoms.copy()
+
+
+@trace.traced
+def read_many(files, cache=True, pool='process', workers=None):
+    """Read several structure files at once, parsing the ones not cached in
+    parallel. Return the structures in the order of files.
+
+    Keyword arguments:
+    files -- iterable of structure files
+    cache -- use and fill the caches of read() (default True)
+    pool -- parse on a thread or process pool, processes are faster for the
+            pure Python CIF parser (default process)
+    workers -- number of threads or processes (default number of CPUs)
+    """
+    if pool == 'thread':
+        executor = concurrent.futures.ThreadPoolExecutor
+    elif pool == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor
+    else:
+        raise ValueError(pool + ' not supported')
+
+    files = list(files)
+    keys = [_key(f) if cache else i for i, f in enumerate(files)]
+    found = {}
+    missing = collections.OrderedDict()
+
+    for key, file in zip(keys, files):
+        if key in found or key in missing:
+            continue
+
+        atoms = _lookup(key) if cache else None
+
+        if atoms is None:
+            missing[key] = file
+        else:
+            found[key] = atoms
+
+    if len(missing) == 1:
+        found.update((key, _parse(file)) for key, file in missing.items())
+    elif missing:
+        with executor(workers) as e:
+            found.update(zip(missing, e.map(_parse, missing.values())))
+
+    if not cache:
+        return [found[key] for key in keys]
+
+    for key, atoms in found.items():
+        _store(key, atoms, parsed=key in missing)
+
+    return [found[key].copy() for key in keys]
+
+
+def write(file, atoms, **kwargs):
+    """Write a structure file.
+
+    Files ending in .npz are written in a compact format holding only the
+    cell, positions, atomic numbers and lattice constants, which read() loads
+    without going through a parser. Any other file is written with ASE,
+    passing on the keyword arguments.
+    """
+    if file.split('.')[-1] == 'npz':
+        _write_compact(file, atoms)
+    else:
+        ase.io.write(file, atoms, **kwargs)
+
+
+def write_stream(file, atoms, format=None, chunk_size=65536):
+    """Write a large structure to a LAMMPS data, extended XYZ or XYZ file in
+    chunks of atoms.
+
+    Each chunk is formatted in one go and written out before the next, so
+    the text of the whole structure is never held in memory. The files match
+    the ones written by ASE, with the atom types of LAMMPS data files in the
+    alphabetical order of the elements.
+
+    Keyword arguments:
+    file -- file to write
+    atoms -- structure, or Atoms.tiled() view, to write
+    format -- lammps-data, extxyz or xyz, guessed from the extension of file
+              if None, where .xyz means extxyz as with ASE
+    chunk_size -- number of atoms formatted at once (default 65536)
+    """
+    if format is None:
+        format = _stream_extensions.get(file.split('.')[-1], file)
+
+    if format not in _stream_writers:
+        raise ValueError(format + ' not supported')
+
+    if isinstance(atoms, Tiling):
+        chunks = atoms.chunks(chunk_size)
+        species = sorted(atoms.composition())
+    else:
+        positions = atoms.positions
+        numbers = atoms.numbers
+        chunks = ((positions[i:i + chunk_size], numbers[i:i + chunk_size])
+                  for i in range(0, len(atoms), chunk_size))
+        species = sorted(chemical_symbols[n] for n in np.unique(numbers))
+
+    with open(file, 'w') as f:
+        _stream_writers[format](f, atoms.get_cell()[:], atoms.get_pbc(),
+                                len(atoms), species, chunks)
+
+
+def clear_cache():
+    """Drop all the structures cached in memory by read()."""
+    _cache.clear()
+
+
+def _key(file):
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+
+    return (path, stat.st_mtime, stat.st_size)
 
-from .atoms import Atoms
 
+def _lookup(key):
+    """Return a cached structure, or None."""
+    atoms = _cache.pop(key, None)
+
+    if atoms is None and cache_dir is not None:
+        atoms = _read_cache_dir(key)
+
+    return atoms
+
+
+def _store(key, atoms, parsed=False):
+    """Cache a structure as the most recently read one."""
+    if parsed and cache_dir is not None:
+        _write_cache_dir(key, atoms)
+
+    _cache[key] = atoms
+
+    while len(_cache) > cache_size:
+        _cache.popitem(last=False)
+
+
+def _parse(file):
+    if file.split('.')[-1] == 'npz':
+        with np.load(file) as data:
+            return _from_compact(data)
 
-def read(file):
     atoms = ase.io.read(file)
     cell = atoms.get_cell()
     positions = atoms.get_positions()
@@ -16,3 +197,118 @@ def read(file):
 
     return Atoms(cell=cell, positions=positions, numbers=numbers,
                  lat_const=lat_const, pbc=[1, 1, 0])
+
+
+def _from_compact(data):
+    return Atoms(cell=data['cell'], positions=data['positions'],
+                 numbers=data['numbers'],
+                 lat_const=data['lat_const'].tolist(), pbc=[1, 1, 0])
+
+
+def _write_compact(file, atoms, **extra):
+    lat_const = getattr(atoms, 'lat_const', [0, 0, 0])
+    np.savez(file, cell=np.array(atoms.get_cell()),
+             positions=atoms.get_positions(), numbers=atoms.numbers,
+             lat_const=np.array(lat_const, dtype=float), **extra)
+
+
+def _cache_file(key):
+    return os.path.join(cache_dir,
+                        hashlib.sha1(key[0].encode('utf-8')).hexdigest() +
+                        '.npz')
+
+
+def _read_cache_dir(key):
+    try:
+        data = np.load(_cache_file(key))
+    except (IOError, OSError, ValueError):
+        return None
+
+    with data:
+        if data['mtime'] != key[1] or data['size'] != key[2]:
+            return None
+
+        return _from_compact(data)
+
+
+def _write_cache_dir(key, atoms):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    _write_compact(_cache_file(key), atoms, mtime=key[1], size=key[2])
+
+
+def _write_xyz_chunks(f, cell, pbc, num_atoms, species, chunks,
+                      extended=True):
+    if extended:
+        comment = ('Lattice="{0}" Properties=species:S:1:pos:R:3 '
+                   'pbc="{1}"').format(
+                       ' '.join(repr(float(v)) for v in cell.ravel()),
+                       ' '.join('T' if p else 'F' for p in pbc))
+        row = '%-2s %16.8f %16.8f %16.8f\n'
+    else:
+        comment = ''
+        row = '%-2s %22.15f %22.15f %22.15f\n'
+
+    f.write('{0}\n{1}\n'.format(num_atoms, comment))
+    symbols = np.array(chemical_symbols, dtype=object)
+
+    for positions, numbers in chunks:
+        values = np.empty((len(numbers), 4), dtype=object)
+        values[:, 0] = symbols[numbers]
+        values[:, 1:] = positions
+        f.write((row * len(numbers)) % tuple(values.ravel()))
+
+
+def _write_plain_xyz_chunks(*args):
+    _write_xyz_chunks(*args, extended=False)
+
+
+def _write_lammps_chunks(f, cell, pbc, num_atoms, species, chunks):
+    from ase.calculators.lammps import Prism
+
+    prism = Prism(cell)
+    xhi, yhi, zhi, xy, xz, yz = prism.get_lammps_prism()
+    f.write('(written by atoms2d)\n\n')
+    f.write('{0} atoms\n{1} atom types\n\n'.format(num_atoms, len(species)))
+    f.write('0.0 {0:23.17g}  xlo xhi\n'.format(xhi))
+    f.write('0.0 {0:23.17g}  ylo yhi\n'.format(yhi))
+    f.write('0.0 {0:23.17g}  zlo zhi\n'.format(zhi))
+
+    if prism.is_skewed():
+        f.write('{0:23.17g} {1:23.17g} {2:23.17g}  xy xz yz\n'.format(
+            xy, xz, yz))
+
+    f.write('\nMasses\n\n')
+    types = np.zeros(len(chemical_symbols), dtype=int)
+
+    for i, s in enumerate(species):
+        types[atomic_numbers[s]] = i + 1
+        f.write('{0} {1:23.17g} # {2}\n'.format(
+            i + 1, atomic_masses[atomic_numbers[s]], s))
+
+    f.write('\nAtoms # atomic\n\n')
+    row = '%6d %3d %23.17g %23.17g %23.17g\n'
+    start = 1
+
+    for positions, numbers in chunks:
+        values = np.empty((len(numbers), 5))
+        values[:, 0] = np.arange(start, start + len(numbers))
+        values[:, 1] = types[numbers]
+        values[:, 2:] = prism.vector_to_lammps(positions)
+        f.write((row * len(numbers)) % tuple(values.ravel().tolist()))
+        start += len(numbers)
+
+
+_stream_writers = {
+    'extxyz': _write_xyz_chunks,
+    'xyz': _write_plain_xyz_chunks,
+    'lammps-data': _write_lammps_chunks,
+}
+
+_stream_extensions = {
+    'extxyz': 'extxyz',
+    'xyz': 'extxyz',
+    'lmp': 'lammps-data',
+    'data': 'lammps-data',
+}
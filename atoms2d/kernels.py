@@ -0,0 +1,193 @@
+"""Kernels for the neighbor search and the smoothing steps of relax, with a
+NumPy backend and an optional Numba one.
+
+The backend is chosen per call with the backend keyword argument of the
+functions using these kernels, or globally with set_backend(). If Numba is
+not installed, the NumPy backend is used instead.
+"""
+import warnings
+
+import numpy as np
+
+_backend = 'numpy'
+_numba_kernels = None
+
+
+def set_backend(name):
+    """Set the backend used by default, either numpy or numba."""
+    global _backend
+
+    if name not in ['numpy', 'numba']:
+        raise ValueError(name + ' not supported')
+
+    _backend = name
+
+
+def get_backend(name=None):
+    """Return the backend to use for the given choice, the default one if
+    it is None."""
+    if name is None:
+        name = _backend
+
+    if name not in ['numpy', 'numba']:
+        raise ValueError(name + ' not supported')
+
+    if name == 'numba' and _load_numba() is None:
+        warnings.warn('numba is not installed, using numpy instead')
+        return 'numpy'
+
+    return name
+
+
+def pairs_within(positions, cutoff, backend=None):
+    """Return the index arrays i and j of every ordered pair of positions
+    strictly closer than the cutoff, without periodic boundaries. The order
+    of the pairs depends on the backend.
+
+    The numpy backend uses a KD-tree and the numba one a binned cell list.
+    """
+    if len(positions) < 2:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    lower = positions.min(axis=0)
+    extent = positions.max(axis=0) - lower
+    positions = positions - lower
+
+    if get_backend(backend) == 'numba':
+        return _pairs_within_numba(positions, extent, cutoff)
+
+    from scipy.spatial import cKDTree
+
+    # The tree includes pairs at exactly the cutoff
+    pairs = cKDTree(positions).query_pairs(cutoff, output_type='ndarray')
+    D = positions[pairs[:, 1]] - positions[pairs[:, 0]]
+    pairs = pairs[np.sqrt((D**2).sum(axis=1)) < cutoff]
+
+    return (np.concatenate([pairs[:, 0], pairs[:, 1]]),
+            np.concatenate([pairs[:, 1], pairs[:, 0]]))
+
+
+def smooth(operator, x, b, backend=None):
+    """Return operator x + b for a CSR operator."""
+    if get_backend(backend) == 'numba':
+        out = np.empty((operator.shape[0], x.shape[1]))
+        _load_numba()['csr_dot'](operator.indptr, operator.indices,
+                                 operator.data, np.ascontiguousarray(x),
+                                 np.ascontiguousarray(b), out)
+        return out
+
+    return operator.dot(x) + b
+
+
+def _pairs_within_numba(positions, extent, cutoff):
+    # Use bins at least as large as the cutoff, coarser if there would be
+    # many more bins than atoms
+    size = cutoff
+
+    while True:
+        shape = (extent // size).astype(np.int64) + 1
+
+        if shape.prod() <= 8 * len(positions) + 1000:
+            break
+
+        size *= 2
+
+    cells = (positions // size).astype(np.int64)
+    flat = (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+    order = np.argsort(flat, kind='stable')
+    starts = np.searchsorted(flat[order], np.arange(shape.prod() + 1))
+
+    kernels = _load_numba()
+    counts = np.empty(len(positions), dtype=np.int64)
+    kernels['pair_counts'](positions, cells, order, starts, shape,
+                           cutoff * cutoff, counts)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    j = np.empty(offsets[-1], dtype=np.int64)
+    kernels['pair_fill'](positions, cells, order, starts, shape,
+                         cutoff * cutoff, offsets, j)
+
+    return np.repeat(np.arange(len(positions)), counts), j
+
+
+def _load_numba():
+    """Compile the Numba kernels on first use, None without Numba."""
+    global _numba_kernels
+
+    if _numba_kernels is not None:
+        return _numba_kernels or None
+
+    try:
+        import numba
+    except ImportError:
+        _numba_kernels = {}
+        return None
+
+    @numba.njit(cache=True)
+    def visit(positions, cells, order, starts, shape, cutoff2, i, out,
+              offset):
+        # Count, and store if out is not empty, the neighbors of atom i in
+        # the surrounding bins
+        count = 0
+
+        for x in range(max(cells[i, 0] - 1, 0),
+                       min(cells[i, 0] + 2, shape[0])):
+            for y in range(max(cells[i, 1] - 1, 0),
+                           min(cells[i, 1] + 2, shape[1])):
+                for z in range(max(cells[i, 2] - 1, 0),
+                               min(cells[i, 2] + 2, shape[2])):
+                    b = (x * shape[1] + y) * shape[2] + z
+
+                    for k in range(starts[b], starts[b + 1]):
+                        j = order[k]
+
+                        if j == i:
+                            continue
+
+                        d2 = 0.0
+
+                        for c in range(3):
+                            d = positions[j, c] - positions[i, c]
+                            d2 += d * d
+
+                        if d2 < cutoff2:
+                            if len(out) > 0:
+                                out[offset + count] = j
+
+                            count += 1
+
+        return count
+
+    @numba.njit(parallel=True, cache=True)
+    def pair_counts(positions, cells, order, starts, shape, cutoff2,
+                    counts):
+        empty = np.empty(0, dtype=np.int64)
+
+        for i in numba.prange(len(positions)):
+            counts[i] = visit(positions, cells, order, starts, shape,
+                              cutoff2, i, empty, 0)
+
+    @numba.njit(parallel=True, cache=True)
+    def pair_fill(positions, cells, order, starts, shape, cutoff2, offsets,
+                  j):
+        for i in numba.prange(len(positions)):
+            visit(positions, cells, order, starts, shape, cutoff2, i, j,
+                  offsets[i])
+
+    @numba.njit(parallel=True, cache=True)
+    def csr_dot(indptr, indices, data, x, b, out):
+        for row in numba.prange(len(indptr) - 1):
+            for c in range(x.shape[1]):
+                total = 0.0
+
+                for k in range(indptr[row], indptr[row + 1]):
+                    total += data[k] * x[indices[k], c]
+
+                out[row, c] = total + b[row, c]
+
+    _numba_kernels = {
+        'pair_counts': pair_counts,
+        'pair_fill': pair_fill,
+        'csr_dot': csr_dot,
+    }
+
+    return _numba_kernels
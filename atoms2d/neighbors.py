@@ -0,0 +1,306 @@
+import hashlib
+import os
+
+import numpy as np
+import scipy.sparse
+from ase.neighborlist import primitive_neighbor_list
+
+from . import kernels
+from .atoms import DC, TM, species_classes
+
+
+def neighbor_pairs(atoms, cutoff, mic=False, same_plane=True,
+                   same_type=True, backend=None):
+    """Return the index arrays i and j of every ordered pair of atoms that
+    are closer than the cutoff.
+
+    Without the minimum image convention, the search is done by
+    kernels.pairs_within, with a KD-tree on the numpy backend and a binned
+    cell list on the numba one. With it, ASE's neighbor list is used. Each
+    pair appears once in each direction and i is sorted.
+
+    Keyword arguments:
+    atoms -- structure to search
+    cutoff -- pairs strictly closer than this distance are returned
+    mic -- use the minimum image convention along the periodic directions of
+           the cell (default False)
+    same_plane -- only keep pairs lying roughly on the same plane
+                  (default True)
+    same_type -- only keep pairs whose elements belong to the same group
+                 (default True)
+    backend -- kernel backend for the search without minimum image, see
+               atoms2d.kernels (default None)
+    """
+    num_atoms = len(atoms)
+    positions = atoms.get_positions()
+
+    if num_atoms < 2:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    if mic:
+        i, j, D = primitive_neighbor_list('ijD', atoms.get_pbc(),
+                                          atoms.get_cell()[:], positions,
+                                          cutoff)
+        dz = D[:, 2]
+    else:
+        i, j = kernels.pairs_within(positions, cutoff, backend=backend)
+        dz = positions[j, 2] - positions[i, 2]
+
+    keep = np.ones(len(i), dtype=bool)
+
+    if same_plane:
+        keep &= np.abs(dz) < 1
+
+    if same_type:
+        classes = species_classes(atoms)
+        tm = classes == TM
+        dc = classes == DC
+        keep &= (tm[i] == tm[j]) | (dc[i] == dc[j])
+
+    return _sorted_pairs(i[keep] * num_atoms + j[keep], num_atoms)
+
+
+def _sorted_pairs(codes, num_atoms):
+    """Return the index arrays of pairs encoded as i * num_atoms + j, sorted
+    and without duplicates such as periodic images of the same pair."""
+    codes = np.sort(codes)
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    codes = codes[first]
+
+    return codes // num_atoms, codes % num_atoms
+
+
+def neighbor_matrix(atoms, cutoff, **kwargs):
+    """Return the neighbor pairs as a symmetric CSR adjacency matrix.
+
+    Takes the same keyword arguments as neighbor_pairs.
+    """
+    num_atoms = len(atoms)
+    i, j = neighbor_pairs(atoms, cutoff, **kwargs)
+
+    return scipy.sparse.csr_matrix((np.ones(len(i)), (i, j)),
+                                   shape=(num_atoms, num_atoms))
+
+
+class NeighborGraph:
+    """Neighbor pairs of a structure as a symmetric CSR adjacency matrix that
+    is kept up to date as the structure changes.
+
+    The graph remembers every pair within the cutoff plus a skin distance.
+    As long as no atom has moved more than half the skin, updating it only
+    filters these pairs by their new distances. Around the atoms that moved
+    further or changed element, the pairs are searched for again. The graph
+    is rebuilt if the number of atoms changed or if the minimum image
+    convention is used.
+
+    Keyword arguments:
+    cutoff -- pairs strictly closer than this distance are neighbors
+    mic -- use the minimum image convention (default False)
+    skin -- extra distance of the remembered pairs (default 1.0)
+    backend -- kernel backend, see atoms2d.kernels (default None)
+    """
+    def __init__(self, cutoff=None, mic=False, skin=1.0, backend=None):
+        self.skin = skin
+        self.backend = backend
+        self.reset(cutoff, mic)
+
+    def reset(self, cutoff, mic=False):
+        """Forget the graph and use a new cutoff."""
+        self.cutoff = cutoff
+        self.mic = mic
+        self.matrix = None
+        self.pairs = None
+        self.reference = None
+        self.numbers = None
+        self.cell = None
+
+    def update(self, atoms, changed=None):
+        """Bring the graph up to date with a structure and return the
+        adjacency matrix.
+
+        Keyword arguments:
+        atoms -- structure the graph describes
+        changed -- indices or mask of atoms to search again around, on top of
+                   the ones found to have moved or changed element
+        """
+        positions = atoms.get_positions()
+
+        if self.mic:
+            if (self.matrix is None or changed is not None or
+                    len(atoms) != len(self.numbers) or
+                    (positions != self.reference).any() or
+                    (atoms.numbers != self.numbers).any() or
+                    (atoms.cell[:] != self.cell).any()):
+                self.matrix = neighbor_matrix(atoms, self.cutoff, mic=True,
+                                              backend=self.backend)
+                self.reference = positions
+                self.numbers = atoms.numbers.copy()
+                self.cell = atoms.cell[:].copy()
+
+            return self.matrix
+
+        far = None
+
+        if self.pairs is not None and len(atoms) == len(self.numbers):
+            far = ((np.abs(positions - self.reference) > self.skin / 2)
+                   .any(axis=1) | (atoms.numbers != self.numbers))
+
+            if changed is not None:
+                far[changed] = True
+
+        # Searching around most of the atoms costs more than starting over
+        if far is None or far.mean() > 0.25:
+            self.pairs = neighbor_pairs(atoms, self.cutoff + self.skin,
+                                        same_plane=False,
+                                        backend=self.backend)
+            self.reference = positions
+            self.numbers = atoms.numbers.copy()
+        elif far.any():
+            self._search(atoms, far)
+
+        i, j = self.pairs
+        D = positions[j] - positions[i]
+        keep = ((np.sqrt((D**2).sum(axis=1)) < self.cutoff) &
+                (np.abs(D[:, 2]) < 1))
+        num_atoms = len(atoms)
+        self.matrix = scipy.sparse.csr_matrix(
+            (np.ones(keep.sum()), (i[keep], j[keep])),
+            shape=(num_atoms, num_atoms))
+
+        return self.matrix
+
+    def save(self, file):
+        """Save the graph to an npz file."""
+        arrays = {}
+
+        for name in ['pairs', 'reference', 'numbers', 'cell']:
+            value = getattr(self, name)
+
+            if value is not None:
+                arrays[name] = np.asarray(value)
+
+        if self.matrix is not None:
+            arrays['indptr'] = self.matrix.indptr
+            arrays['indices'] = self.matrix.indices
+
+        np.savez(file, cutoff=self.cutoff, mic=self.mic, skin=self.skin,
+                 **arrays)
+
+    @classmethod
+    def load(cls, file, backend=None):
+        """Load a graph saved with save()."""
+        with np.load(file) as data:
+            graph = cls(float(data['cutoff']), bool(data['mic']),
+                        float(data['skin']), backend)
+
+            if 'pairs' in data:
+                graph.pairs = tuple(data['pairs'])
+
+            for name in ['reference', 'numbers', 'cell']:
+                if name in data:
+                    setattr(graph, name, data[name])
+
+            if 'indptr' in data:
+                num_atoms = len(data['indptr']) - 1
+                graph.matrix = scipy.sparse.csr_matrix(
+                    (np.ones(len(data['indices'])), data['indices'],
+                     data['indptr']), shape=(num_atoms, num_atoms))
+
+        return graph
+
+    def _search(self, atoms, far):
+        """Search again for the pairs of the given atoms."""
+        positions = atoms.positions
+
+        # Atoms that moved by less than half the skin since the last search
+        # can have moved a whole skin since a pair with them was found, so
+        # search a further half skin out.
+        cutoff = self.cutoff + 1.5 * self.skin
+
+        # Only atoms in the bins around the far ones can be their neighbors
+        bins = np.floor((positions - positions.min(axis=0)) /
+                        cutoff).astype(int)
+        shape = bins.max(axis=0) + 3
+        codes = np.ravel_multi_index((bins + 1).T, shape)
+        offsets = np.array([[x, y, z] for x in (-1, 0, 1)
+                            for y in (-1, 0, 1) for z in (-1, 0, 1)])
+        around = np.ravel_multi_index(
+            (np.unique(bins[far] + 1, axis=0)[:, None] + offsets)
+            .reshape(-1, 3).T, shape)
+        nearby = np.flatnonzero(np.isin(codes, around))
+
+        i, j = neighbor_pairs(atoms[nearby], cutoff, same_plane=False,
+                              backend=self.backend)
+        i, j = nearby[i], nearby[j]
+        new = far[i] | far[j]
+        old = ~(far[self.pairs[0]] | far[self.pairs[1]])
+        self.pairs = _sorted_pairs(np.concatenate([
+            self.pairs[0][old] * len(atoms) + self.pairs[1][old],
+            i[new] * len(atoms) + j[new]]), len(atoms))
+        self.reference[far] = positions[far]
+        self.numbers[far] = atoms.numbers[far]
+
+
+class GraphCache:
+    """Directory of saved neighbor graphs, keyed on a hash of the structure
+    and the search settings. Once the files take up more than max_size
+    bytes, the least recently used ones are deleted.
+
+    Example:
+    cache = neighbors.GraphCache('graphs')
+    relax(atoms, a, steps=100, cache=cache)
+    """
+    def __init__(self, directory, max_size=2**30):
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, atoms, cutoff, mic=False):
+        """Return the hash of a structure and search settings."""
+        sha = hashlib.sha1()
+
+        for a in [atoms.get_positions(), atoms.numbers,
+                  np.array(atoms.cell[:]), np.array([cutoff, mic], float)]:
+            sha.update(np.ascontiguousarray(a).tobytes())
+
+        return sha.hexdigest()
+
+    def get(self, atoms, cutoff, mic=False, backend=None):
+        """Return the saved graph of a structure, or None."""
+        file = self._file(self.key(atoms, cutoff, mic))
+
+        try:
+            graph = NeighborGraph.load(file, backend)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        # Mark the file as recently used
+        os.utime(file, None)
+
+        return graph
+
+    def put(self, atoms, graph):
+        """Save the graph of a structure and evict old graphs."""
+        graph.save(self._file(self.key(atoms, graph.cutoff, graph.mic)))
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used graphs until the cache fits."""
+        files = [os.path.join(self.directory, f)
+                 for f in os.listdir(self.directory) if f.endswith('.npz')]
+        stats = sorted((os.stat(f).st_mtime, os.stat(f).st_size, f)
+                       for f in files)
+        size = sum(s[1] for s in stats)
+
+        for _, file_size, file in stats:
+            if size <= self.max_size:
+                break
+
+            os.remove(file)
+            size -= file_size
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.npz')
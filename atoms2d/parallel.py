@@ -0,0 +1,156 @@
+"""Domain decomposed smoothing steps for relax on several processes."""
+import multiprocessing
+import multiprocessing.connection
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import kernels
+
+
+class SlabSmoother:
+    """Compute operator x + b with the rows split into slabs along x, each
+    one handled by its own worker process.
+
+    The current and next positions live in shared memory. Each worker reads
+    the positions of its own slab and of the halo of neighbors around it
+    straight from the shared buffer, and writes the rows of its slab. Every
+    row is summed in the same order as in a serial step, so the result is
+    bit-identical.
+
+    If a worker fails or exits, the step raises RuntimeError rather than
+    waiting for it forever.
+
+    Keyword arguments:
+    operator -- CSR operator
+    b -- constant term
+    coordinates -- x coordinate of each row, used to split the slabs
+    processes -- number of worker processes
+    backend -- kernel backend, see atoms2d.kernels (default None)
+    timeout -- seconds to wait for a step before giving up, no limit if None
+    """
+    def __init__(self, operator, b, coordinates, processes, backend=None,
+                 timeout=None):
+        self.shape = b.shape
+        self.timeout = timeout
+        self.closed = False
+        self.memory = [shared_memory.SharedMemory(create=True,
+                                                  size=max(b.nbytes, 1))
+                       for _ in range(2)]
+        self.start = multiprocessing.Barrier(processes + 1)
+        self.done = multiprocessing.Barrier(processes + 1)
+        self.stop = multiprocessing.Value('b', 0)
+        self.workers = []
+
+        order = np.argsort(coordinates, kind='stable')
+
+        try:
+            for rows in np.array_split(order, processes):
+                rows = np.sort(rows)
+                worker = multiprocessing.Process(
+                    target=_work,
+                    args=([m.name for m in self.memory], self.shape,
+                          operator[rows], b[rows], rows, self.start,
+                          self.done, self.stop, backend))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        except BaseException:
+            self.close()
+            raise
+
+        # Release the barriers as soon as a worker exits, so a crashed worker
+        # never leaves the steps waiting for it
+        self.watcher = threading.Thread(target=self._watch)
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def __call__(self, x):
+        """Return operator x + b."""
+        if self.closed:
+            raise RuntimeError('smoother is closed')
+
+        self._buffers()[0][:] = x
+
+        try:
+            self.start.wait(self.timeout)
+            self.done.wait(self.timeout)
+        except threading.BrokenBarrierError:
+            self._abort()
+            raise RuntimeError('a slab worker failed or timed out')
+
+        return self._buffers()[1].copy()
+
+    def close(self):
+        """Stop the workers and free the shared memory. Safe to call after a
+        failed or interrupted step, and more than once."""
+        if self.closed:
+            return
+
+        self.closed = True
+        self.stop.value = 1
+
+        # Workers waiting on either barrier stop on the abort
+        self._abort()
+
+        for worker in self.workers:
+            worker.join(10)
+
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+
+    def _abort(self):
+        self.start.abort()
+        self.done.abort()
+
+    def _watch(self):
+        multiprocessing.connection.wait([w.sentinel for w in self.workers])
+
+        if not self.closed:
+            self._abort()
+
+    def _buffers(self):
+        return [np.ndarray(self.shape, buffer=m.buf) for m in self.memory]
+
+
+def _work(names, shape, operator, b, rows, start, done, stop, backend):
+    """Run the steps of one slab until told to stop."""
+    memory = [shared_memory.SharedMemory(name=n) for n in names]
+
+    try:
+        while True:
+            start.wait()
+
+            if stop.value:
+                break
+
+            _step(memory, shape, operator, b, rows, backend)
+            done.wait()
+    except threading.BrokenBarrierError:
+        # Stopped by close(), or another worker failed
+        pass
+    except BaseException:
+        start.abort()
+        done.abort()
+        raise
+    finally:
+        for m in memory:
+            try:
+                m.close()
+            except BufferError:
+                # A failed step can still hold views through its traceback,
+                # the mapping goes away with the process
+                pass
+
+
+def _step(memory, shape, operator, b, rows, backend):
+    # The views on the shared memory must be gone before it is closed, so
+    # keep them local to this function
+    current, following = [np.ndarray(shape, buffer=m.buf) for m in memory]
+    following[rows] = kernels.smooth(operator, current, b, backend)
@@ -1,4 +1,5 @@
 import numpy as np
+from ase.data import atomic_numbers
 
 
 class Polygon:
@@ -39,33 +40,63 @@ class Polygon:
                                  + center[1])
 
 
-def where(array, equal):
-    """Find the index of a 2D array where it equals to another array."""
-    for i, a in enumerate(array):
-        if (a == equal).all():
-            return i
+class Chunks:
+    """Collect structures and join them into a single structure at once,
+    rather than reallocating every per-atom array on each extend. The
+    structures must not be changed after they are added."""
+    def __init__(self, atoms):
+        self.atoms = atoms
+        self.chunks = [atoms.arrays]
 
+    def __len__(self):
+        return sum(len(c['positions']) for c in self.chunks)
 
-def is_even(integer):
-    """Return true if number is even, false otherwise."""
-    return integer % 2 == 0
+    def add(self, atoms):
+        self.chunks.append(atoms.arrays)
+
+    def join(self):
+        """Return a copy of the first structure extended by all the others.
+        Arrays missing from some of the structures are filled with zeros."""
+        atoms = self.atoms.copy()
+        arrays = {}
+
+        for chunk in self.chunks:
+            for name, a in chunk.items():
+                arrays.setdefault(name, a)
+
+        for name, a in arrays.items():
+            atoms.arrays[name] = np.concatenate([
+                c[name] if name in c else
+                np.zeros((len(c['positions']),) + a.shape[1:], a.dtype)
+                for c in self.chunks
+            ])
 
+        return atoms
 
-def is_tm(symbol):
-    """Return true if an element is a transition metal."""
-    return symbol in ['Mo', 'W']
 
+def axis_index(along):
+    """Return the index of the x, y or z axis, defaulting to x."""
+    return {'y': 1, 'z': 2}.get(along, 0)
 
-def is_dc(symbol):
-    """Return true if an element is a chalcogen."""
-    return symbol in ['S', 'Se']
 
+def symbol_mask(atoms, symbols):
+    """Return a boolean mask of the atoms with one of the given symbols."""
+    return np.isin(atoms.numbers, [atomic_numbers[s] for s in symbols])
 
-def is_same_type(a, b):
-    """Return true if both material belong to the same group."""
-    return is_tm(a) == is_tm(b) or is_dc(a) == is_dc(b)
 
+def extreme_atom(atoms, symbols, along='x', largest=False):
+    """Return the index of the atom with the smallest, or largest, coordinate
+    along a direction out of the atoms with one of the given symbols. Ties go
+    to the lowest index."""
+    candidates = np.flatnonzero(symbol_mask(atoms, symbols))
+    coordinates = atoms.positions[candidates, axis_index(along)]
 
-def is_same_plane(a, b):
-    """Return true if both position lie roughly on the same plane."""
-    return abs(a[2] - b[2]) < 1
+    if largest:
+        return candidates[np.argmax(coordinates)]
+
+    return candidates[np.argmin(coordinates)]
+
+
+def is_even(integer):
+    """Return true if number is even, false otherwise."""
+    return integer % 2 == 0
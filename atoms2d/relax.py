@@ -1,83 +1,319 @@
 from __future__ import print_function
-import networkx as nx
+import hashlib
+import os
 
-from . import private
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 
+from . import kernels
+from . import neighbors
+from . import trace
 
-def relax(atoms, lat_const, steps=1, fixed=[]):
+# Most steps taken when relaxing until tol without a number of steps
+MAX_STEPS = 10000
+
+
+@trace.traced
+def relax(atoms, lat_const, steps=None, fixed=[], mic=False, tol=None,
+          method='jacobi', omega=1.0, backend=None, active=None, shells=2,
+          graph=None, cache=None, trajectory=None, stride=1,
+          checkpoint=None, checkpoint_interval=100, processes=None):
     """Relax a structure by minimizing the distance between each atom where the
-    edge atoms are all fixed."""
-    # Add all atoms as nodes to a graph
-    graph = nx.Graph()
-    num_atoms = len(atoms)
-    atoms_range = range(num_atoms)
-    symbols = atoms.get_chemical_symbols()
+    edge atoms are all fixed.
+
+    Neighbors are searched within 1.5 lattice constants, across the periodic
+    cell boundaries if mic is true. The largest displacement of each step is
+    stored in atoms.info['relax_residuals'], and whether it fell below tol in
+    atoms.info['relax_converged'].
+
+    After a local change, such as a new dislocation core, only the changed
+    atoms and a few neighbor shells around them need relaxing again. Passing
+    the same graph to each call then also limits the neighbor search to the
+    atoms that moved since the previous call.
+
+    Long runs can stream every stride-th step to a trajectory file, in any
+    format ASE can append to such as traj or extxyz, and save checkpoints.
+    Calling relax again on the same starting structure and settings with the
+    same checkpoint file resumes from the last checkpoint, and raises
+    ValueError if that is already past steps. Jacobi and SOR runs resume
+    exactly, Chebyshev ones restart their acceleration.
+
+    Jacobi and Chebyshev steps on large sheets can be split across several
+    processes, each smoothing a slab of the sheet along x. The positions are
+    shared between them, so the result is the same as on one process.
+
+    Keyword arguments:
+    atoms -- structure to relax in place
+    lat_const -- lattice constant
+    steps -- number of steps, or the maximum number if tol is set (default
+             None, a single step without tol and up to MAX_STEPS with it)
+    fixed -- positions of extra atoms to keep fixed
+    mic -- use the minimum image convention (default False)
+    tol -- stop once no atom moves further than this in a step
+    method -- jacobi, sor (successive over-relaxation) or chebyshev
+              (default jacobi)
+    omega -- relaxation factor for sor, 1 gives Gauss-Seidel (default 1.0)
+    backend -- kernel backend, see atoms2d.kernels (default None)
+    active -- indices or mask of the atoms to relax, all if None
+    shells -- number of neighbor shells added around the active atoms
+              (default 2)
+    graph -- neighbors.NeighborGraph reused and updated between calls, pass
+             an empty one to get the graph of this call back
+    cache -- neighbors.GraphCache to load the graph from, and save it to,
+             when graph is None
+    trajectory -- file to append the relaxing structure to
+    stride -- number of steps between frames of the trajectory (default 1)
+    checkpoint -- npz file to save the progress to, and resume from
+    checkpoint_interval -- number of steps between checkpoints (default 100)
+    processes -- number of processes for jacobi and chebyshev steps
+                 (default None, a single one)
+    """
+    if method not in ['jacobi', 'sor', 'chebyshev']:
+        raise ValueError(method + ' not supported')
+
+    if method == 'sor' and processes is not None and processes > 1:
+        raise ValueError('sor not supported on several processes')
+
+    if steps is None:
+        steps = 1 if tol is None else MAX_STEPS
+
+    trace.stage('graph')
+    positions = atoms.positions
+
+    if checkpoint is not None:
+        start = _checkpoint_key(atoms, lat_const, fixed, mic, method, omega,
+                                active, shells)
+
     correction = 0.1
-    sorted_pos = [sorted(atoms.positions, key=lambda p: p[0]),
-                  sorted(atoms.positions, key=lambda p: p[1])]
-    boundaries = {
-        'top': sorted_pos[1][-1][1] - (lat_const / 2 + correction),
-        'right': sorted_pos[0][-1][0] - (lat_const / 2 + correction),
-        'bottom': sorted_pos[1][0][1] + (lat_const / 2 + correction),
-        'left': sorted_pos[0][0][0] + (lat_const / 2 + correction)
-    }
-
-    for i in atoms_range:
-        position = atoms.positions[i][:]
-        graph.add_node(i, fixed=False, position=position)
-
-        if (position[1] > boundaries['top'] or
-                position[0] > boundaries['right'] or
-                position[1] < boundaries['bottom'] or
-                position[0] < boundaries['left']):
-            graph.node[i]['fixed'] = True
-        else:
-            for f in fixed:
-                if all([abs(position[x] - f[x]) <= 1e-4 for x in range(2)]):
-                    graph.node[i]['fixed'] = True
-
-    # Form edges between all nearby atoms
-    radius = 1.5 * lat_const
-    for i in atoms_range:
-        for j in atoms_range:
-            if (i == j or
-                    not private.is_same_plane(atoms.positions[i],
-                                              atoms.positions[j]) or
-                    not private.is_same_type(symbols[i], symbols[j])):
-                continue
-
-            distance = atoms.get_distance(i, j)
-
-            if (distance < radius):
-                graph.add_edge(i, j)
-
-    # Move atoms to centroid of each connected nodes
-    for _ in range(steps):
-        for i in atoms_range:
-            edges = graph[i]
-            num_edges = len(edges)
-
-            if (graph.node[i]['fixed'] or
-                    num_edges < 6 or
-                    not private.is_even(num_edges)):
-                continue
-
-            # Calculate centroid
-            centroid = [0, 0]
-
-            for j in edges:
-                centroid[0] += graph.node[j]['position'][0]
-                centroid[1] += graph.node[j]['position'][1]
-
-            centroid[0] /= num_edges
-            centroid[1] /= num_edges
-
-            # Move atom to the centroid
-            atoms.positions[i][0] += centroid[0] - graph.node[i]['position'][0]
-            atoms.positions[i][1] += centroid[1] - graph.node[i]['position'][1]
-
-        # Update nodes position to their new position
-        for i in atoms_range:
-            graph.node[i]['position'] = atoms.positions[i][:]
+    lower = positions[:, :2].min(axis=0) + (lat_const / 2 + correction)
+    upper = positions[:, :2].max(axis=0) - (lat_const / 2 + correction)
+
+    # Fix the atoms on the edges and the ones requested
+    movable = ((positions[:, :2] >= lower) &
+               (positions[:, :2] <= upper)).all(axis=1)
+
+    for f in fixed:
+        movable &= ~(np.abs(positions[:, :2] - f[:2]) <= 1e-4).all(axis=1)
+
+    cached = None
+
+    if graph is None and cache is not None:
+        graph = cached = cache.get(atoms, 1.5 * lat_const, mic, backend)
+
+    if graph is None:
+        graph = neighbors.NeighborGraph(backend=backend)
+
+    if graph.cutoff != 1.5 * lat_const or graph.mic != mic:
+        graph.reset(1.5 * lat_const, mic)
+
+    adjacency = graph.update(atoms)
+
+    if cache is not None and cached is None:
+        cache.put(atoms, graph)
+
+    if active is not None:
+        region = np.zeros(len(atoms), dtype=bool)
+        region[active] = True
+
+        for _ in range(shells):
+            region |= adjacency.dot(region.astype(float)) > 0
+
+        movable &= region
+
+    # Only atoms with an even coordination of at least six are moved
+    num_edges = np.diff(adjacency.indptr)
+    movable &= (num_edges >= 6) & (num_edges % 2 == 0)
+
+    # Each row averages the neighbors of a movable atom. The part acting on
+    # the atoms that stay put is constant and folded into b.
+    centroid = (scipy.sparse.diags(1.0 / num_edges[movable]) *
+                adjacency[movable]).tocsc()
+    operator = centroid[:, movable].tocsr()
+    b = centroid[:, ~movable].dot(positions[~movable, :2])
+
+    residuals = []
+
+    if checkpoint is not None:
+        residuals = _resume(checkpoint, start, positions, steps)
+
+    if tol is not None and residuals and residuals[-1] < tol:
+        steps = 0
+
+    if not movable.any():
+        steps = 0
+
+    smoother = None
+
+    if processes is not None and processes > 1 and steps > len(residuals):
+        from . import parallel
+
+        trace.stage('workers')
+        smoother = parallel.SlabSmoother(operator, b,
+                                         positions[movable, 0], processes,
+                                         backend)
+        smooth = smoother
+    else:
+        def smooth(x):
+            return kernels.smooth(operator, x, b, backend)
+
+    if method == 'jacobi':
+        iterations = _jacobi(smooth, positions[movable, :2])
+    elif method == 'sor':
+        iterations = _sor(operator, b, positions[movable, :2], omega)
+    else:
+        iterations = _chebyshev(smooth, operator, positions[movable, :2],
+                                num_edges[movable])
+
+    trace.stage('smoothing')
+
+    try:
+        for step in range(len(residuals), steps):
+            x = next(iterations)
+            residuals.append(float(np.sqrt(
+                ((x - positions[movable, :2])**2).sum(axis=1)).max()))
+            positions[movable, :2] = x
+
+            if trajectory is not None and (step + 1) % stride == 0:
+                _write_frame(trajectory, atoms)
+
+            if tol is not None and residuals[-1] < tol:
+                break
+
+            if (checkpoint is not None and
+                    (step + 1) % checkpoint_interval == 0):
+                _save_checkpoint(checkpoint, start, positions, residuals)
+    finally:
+        if smoother is not None:
+            smoother.close()
+
+    if checkpoint is not None:
+        _save_checkpoint(checkpoint, start, positions, residuals)
+
+    atoms.info['relax_residuals'] = residuals
+    atoms.info['relax_converged'] = bool(
+        tol is not None and
+        (not movable.any() or (residuals and residuals[-1] < tol)))
 
     return atoms
+
+
+def _write_frame(trajectory, atoms):
+    """Append a structure to a trajectory file."""
+    import ase.io
+
+    if trajectory.endswith('.traj'):
+        with ase.io.Trajectory(trajectory, 'a') as frames:
+            frames.write(atoms)
+    else:
+        ase.io.write(trajectory, atoms, append=True)
+
+
+def _checkpoint_key(atoms, lat_const, fixed, mic, method, omega, active,
+                    shells):
+    """Return a hash of the starting structure and of every setting shaping
+    the relaxation, so a checkpoint is only resumed by the same run."""
+    sha = hashlib.sha1()
+
+    for a in [atoms.positions, atoms.numbers, np.array(atoms.cell[:]),
+              atoms.get_pbc()]:
+        sha.update(np.ascontiguousarray(a).tobytes())
+
+    if active is not None:
+        region = np.zeros(len(atoms), dtype=bool)
+        region[active] = True
+        sha.update(region.tobytes())
+
+    sha.update(np.array([np.asarray(f, dtype=float)[:2] for f in fixed],
+                        dtype=float).tobytes())
+    sha.update(repr((float(lat_const), bool(mic), method, float(omega),
+                     active is None, shells)).encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+def _resume(checkpoint, start, positions, steps):
+    """Load the positions from a checkpoint of the same starting structure
+    and return the residuals so far. Raise ValueError, leaving the positions
+    as they are, if the checkpoint is further than steps."""
+    try:
+        data = np.load(checkpoint)
+    except (IOError, OSError, ValueError):
+        return []
+
+    with data:
+        if str(data['start']) != start:
+            return []
+
+        residuals = data['residuals'].tolist()
+
+        if len(residuals) > steps:
+            raise ValueError('checkpoint is {0} steps in, past the {1} steps '
+                             'requested'.format(len(residuals), steps))
+
+        positions[:] = data['positions']
+
+        return residuals
+
+
+def _save_checkpoint(checkpoint, start, positions, residuals):
+    # Write to a temporary file first so a killed job never leaves a broken
+    # checkpoint behind
+    temporary = checkpoint + '.tmp.npz'
+    np.savez(temporary, start=start, positions=positions,
+             residuals=np.array(residuals, dtype=float))
+    os.replace(temporary, checkpoint)
+
+
+def _jacobi(smooth, x):
+    """Yield successive Jacobi iterates of x = smooth(x)."""
+    while True:
+        x = smooth(x)
+        yield x
+
+
+def _sor(operator, b, x, omega):
+    """Yield successive over-relaxation iterates of x = operator x + b, with
+    the atoms updated in index order."""
+    identity = scipy.sparse.identity(operator.shape[0], format='csr')
+    lower = (identity - omega * scipy.sparse.tril(operator, -1)).tocsr()
+    upper = ((1 - omega) * identity +
+             omega * scipy.sparse.triu(operator, 1)).tocsr()
+
+    while True:
+        x = scipy.sparse.linalg.spsolve_triangular(
+            lower, upper.dot(x) + omega * b, lower=True)
+        yield x
+
+
+def _chebyshev(smooth, operator, x, num_edges):
+    """Yield Chebyshev accelerated Jacobi iterates of x = smooth(x), where
+    smooth(x) = operator x + b."""
+    rho2 = _spectral_radius(operator, num_edges)**2
+    previous = x
+    x = smooth(x)
+    omega = 1 / (1 - rho2 / 2)
+    yield x
+
+    while True:
+        previous, x = x, omega * (smooth(x) - previous) + previous
+        omega = 1 / (1 - rho2 * omega / 4)
+        yield x
+
+
+def _spectral_radius(operator, num_edges):
+    """Return the spectral radius of the centroid operator."""
+    # The operator D^-1 A is similar to the symmetric D^-1/2 A D^-1/2, so its
+    # eigenvalues are real and can be found with a symmetric solver.
+    scale = np.sqrt(num_edges)
+    symmetric = (scipy.sparse.diags(scale) * operator *
+                 scipy.sparse.diags(1 / scale))
+
+    if operator.shape[0] < 100:
+        return np.abs(np.linalg.eigvalsh(symmetric.toarray())).max()
+
+    # A fixed start vector keeps the result, and so the relaxation,
+    # reproducible
+    return np.abs(scipy.sparse.linalg.eigsh(
+        symmetric, k=1, which='LM', v0=np.ones(operator.shape[0]),
+        return_eigenvectors=False)).max()
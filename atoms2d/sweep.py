@@ -0,0 +1,86 @@
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+
+from . import gb
+from .relax import relax
+
+
+def grid(**params):
+    """Return the keyword arguments of every combination of the given
+    parameter values.
+
+    Example:
+    grid(cif=['MoS2', 'WSe2'], rows=[3, 4], columns=[5], type=['5|7'])
+    """
+    names = sorted(params)
+
+    return [dict(zip(names, values))
+            for values in itertools.product(*(params[n] for n in names))]
+
+
+def sweep(builder, params, relax_options=None, processes=None,
+          max_pending=None, ordered=True):
+    """Build a structure for each set of keyword arguments on a process pool
+    and yield (kwargs, structure) pairs as they finish.
+
+    Keyword arguments:
+    builder -- name of a builder in atoms2d.gb, or any picklable function
+    params -- iterable of keyword argument dicts, such as from grid()
+    relax_options -- keyword arguments for relax() to run on each structure,
+                     lat_const defaults to the structure's own (default None)
+    processes -- number of worker processes (default number of CPUs)
+    max_pending -- maximum number of jobs submitted at once, which bounds the
+                   number of finished structures held in memory
+                   (default twice the number of processes)
+    ordered -- yield in the order of params, otherwise as soon as each job
+               finishes (default True)
+    """
+    if not callable(builder):
+        builder = getattr(gb, builder)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    params = iter(params)
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = collections.deque()
+
+        def submit():
+            for kwargs in itertools.islice(params,
+                                           max_pending - len(pending)):
+                pending.append((kwargs, executor.submit(
+                    _build, builder, kwargs, relax_options)))
+
+        submit()
+
+        while pending:
+            if ordered:
+                kwargs, future = pending.popleft()
+            else:
+                concurrent.futures.wait(
+                    [f for _, f in pending],
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                kwargs, future = next(p for p in pending if p[1].done())
+                pending.remove((kwargs, future))
+
+            structure = future.result()
+            submit()
+
+            yield kwargs, structure
+
+
+def _build(builder, kwargs, relax_options):
+    structure = builder(**kwargs)
+
+    if relax_options is not None:
+        options = dict(relax_options)
+        options.setdefault('lat_const', structure.lat_const[0])
+        relax(structure, **options)
+
+    return structure
@@ -0,0 +1,210 @@
+"""Opt-in timing of the stages of the builders and relaxation.
+
+Example:
+with trace.tracing() as tracer:
+    gb.lh('WSe2', 'MoS2', 5, 8, '5|7')
+
+print(tracer.tree())
+tracer.write_chrome_trace('lh.json')
+
+The builders mark their stages with stage(), which times everything up to
+the next stage or the end of the enclosing span. Spans are only recorded while
+tracing or while a callback is registered, otherwise they do nothing.
+"""
+import contextlib
+import functools
+import json
+import timeit
+
+_tracers = []
+_callbacks = []
+
+
+class Span:
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.children = []
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'children': [c.to_dict() for c in self.children],
+        }
+
+
+class Tracer:
+    """Record the spans entered while it is active as a tree."""
+    def __init__(self):
+        self.spans = []
+        self._stack = []
+
+    def enter(self, name, start):
+        span = Span(name, start)
+        (self._stack[-1].children if self._stack else self.spans).append(span)
+        self._stack.append(span)
+
+    def exit(self, end):
+        self._stack.pop().end = end
+
+    def tree(self):
+        """Return the spans as an indented tree with their durations."""
+        lines = []
+
+        def add(span, depth):
+            lines.append('{0:10.3f} ms  {1}{2}'.format(
+                span.duration * 1e3, '  ' * depth, span.name))
+
+            for child in span.children:
+                add(child, depth + 1)
+
+        for span in self.spans:
+            add(span, 0)
+
+        return '\n'.join(lines)
+
+    def to_json(self, **kwargs):
+        """Return the spans as a JSON tree."""
+        return json.dumps([s.to_dict() for s in self.spans], **kwargs)
+
+    def chrome_trace(self):
+        """Return the spans as Chrome trace complete events."""
+        events = []
+
+        def add(span):
+            events.append({
+                'name': span.name,
+                'ph': 'X',
+                'ts': span.start * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': 0,
+                'tid': 0,
+            })
+
+            for child in span.children:
+                add(child)
+
+        for span in self.spans:
+            add(span)
+
+        return {'traceEvents': events}
+
+    def write_chrome_trace(self, file):
+        """Write the spans to a file readable by chrome://tracing."""
+        with open(file, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+@contextlib.contextmanager
+def tracing(tracer=None):
+    """Record the spans entered within the context into a tracer."""
+    if tracer is None:
+        tracer = Tracer()
+
+    _tracers.append(tracer)
+
+    try:
+        yield tracer
+    finally:
+        _tracers.remove(tracer)
+
+
+def register(callback):
+    """Call callback(name, start, duration) at the end of every span."""
+    _callbacks.append(callback)
+
+
+def unregister(callback):
+    """Stop calling a callback registered with register()."""
+    _callbacks.remove(callback)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _ActiveSpan:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.depth = len(_open)
+        _enter(self.name, False)
+
+        return self
+
+    def __exit__(self, *args):
+        # Also close the last stage left open inside the span
+        while len(_open) > self.depth:
+            _exit()
+
+        return False
+
+
+_null_span = _NullSpan()
+
+# Spans currently open, as (name, start, is stage, tracers) tuples
+_open = []
+
+
+def _enter(name, is_stage):
+    start = timeit.default_timer()
+    tracers = list(_tracers)
+    _open.append((name, start, is_stage, tracers))
+
+    for tracer in tracers:
+        tracer.enter(name, start)
+
+
+def _exit():
+    end = timeit.default_timer()
+    name, start, _, tracers = _open.pop()
+
+    for tracer in tracers:
+        tracer.exit(end)
+
+    for callback in list(_callbacks):
+        callback(name, start, end - start)
+
+
+def span(name):
+    """Return a context manager timing a named stage."""
+    if not _tracers and not _callbacks:
+        return _null_span
+
+    return _ActiveSpan(name)
+
+
+def stage(name):
+    """End the previous stage of the current span, if any, and start timing a
+    new one. The last stage ends with the span."""
+    if not _tracers and not _callbacks:
+        return
+
+    if _open and _open[-1][2]:
+        _exit()
+
+    _enter(name, True)
+
+
+def traced(function):
+    """Decorate a function to time each of its calls as a span."""
+    name = function.__module__.split('.')[-1] + '.' + function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return function(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,154 @@
+"""Benchmarks for the builders, relaxation and editing operations, run with
+asv (https://asv.readthedocs.io).
+
+The primitive cells are generated locally, so no CIF files are needed.
+"""
+import os
+import shutil
+import tempfile
+
+import ase.io
+import numpy as np
+from ase.spacegroup import crystal
+
+import atoms2d
+from atoms2d import dislocation
+from atoms2d import gb
+from atoms2d import io
+
+# Formula, transition metal, chalcogen, a and c of 2H bulk materials
+MATERIALS = {
+    'MoS2': ('Mo', 'S', 3.16, 12.29),
+    'WSe2': ('W', 'Se', 3.28, 12.96),
+}
+
+
+def write_primitive(name, directory):
+    """Write a 2H bulk primitive cell as a CIF file."""
+    tm, dc, a, c = MATERIALS[name]
+    primitive = crystal([tm, dc], basis=[(1 / 3., 2 / 3., 0.25),
+                                         (1 / 3., 2 / 3., 0.621)],
+                        spacegroup=194, cellpar=[a, a, c, 90, 90, 120])
+    ase.io.write(os.path.join(directory, name + '.cif'), primitive)
+
+
+class Benchmark:
+    """Run each benchmark inside a directory holding the primitive cells."""
+    timeout = 600
+
+    def setup(self, *args):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+
+        for name in MATERIALS:
+            write_primitive(name, self.directory)
+
+        os.chdir(self.directory)
+
+    def clear_caches(self, cache):
+        """Drop the parsed primitives and dislocation templates for cold
+        runs, so parsing and core generation are timed too."""
+        if cache == 'cold':
+            io.clear_cache()
+            dislocation.clear_cache()
+
+    def teardown(self, *args):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+
+class Builders(Benchmark):
+    params = (['nr', 'pbc', 'pbc_single'], [3, 6, 12], [4, 16, 64],
+              ['cold', 'warm'])
+    param_names = ['builder', 'rows', 'columns', 'cache']
+
+    def setup(self, builder, rows, columns, cache):
+        super(Builders, self).setup()
+        self.clear_caches('cold')
+        structure = getattr(gb, builder)('MoS2', rows, columns, '5|7')
+        assert len(structure) > 0
+
+    def time_build(self, builder, rows, columns, cache):
+        self.clear_caches(cache)
+        getattr(gb, builder)('MoS2', rows, columns, '5|7')
+
+    def peakmem_build(self, builder, rows, columns, cache):
+        self.clear_caches(cache)
+        getattr(gb, builder)('MoS2', rows, columns, '5|7')
+
+
+class LateralHeterostructure(Benchmark):
+    params = ([3, 6, 12], [4, 16, 32], ['cold', 'warm'])
+    param_names = ['rows', 'columns', 'cache']
+
+    def setup(self, rows, columns, cache):
+        super(LateralHeterostructure, self).setup()
+        self.clear_caches('cold')
+        structure = gb.lh('WSe2', 'MoS2', rows, columns, '5|7')
+        assert len(structure) > 0
+
+    def time_lh(self, rows, columns, cache):
+        self.clear_caches(cache)
+        gb.lh('WSe2', 'MoS2', rows, columns, '5|7')
+
+    def peakmem_lh(self, rows, columns, cache):
+        self.clear_caches(cache)
+        gb.lh('WSe2', 'MoS2', rows, columns, '5|7')
+
+
+class Sheet(Benchmark):
+    """Operations on a flat monolayer sheet of roughly the given number of
+    atoms."""
+    params = [1000, 10000, 100000]
+    param_names = ['atoms']
+
+    def setup(self, num_atoms):
+        super(Sheet, self).setup(num_atoms)
+        primitive = atoms2d.read('MoS2.cif')
+        primitive.to_monolayer()
+        repeat = int(np.ceil(np.sqrt(num_atoms / 3.0)))
+        self.sheet = primitive * (repeat, repeat, 1)
+        self.sheet.to_orthorhombic()
+        self.lat_const = primitive.lat_const[0]
+
+        # Overlap the atoms around the middle of the sheet with a jittered copy
+        self.gb_loc = self.sheet.cell[0][0] / 2
+        self.overlapping = self.sheet.copy()
+        seam = self.overlapping[
+            np.abs(self.overlapping.positions[:, 0] - self.gb_loc) <
+            self.lat_const]
+        seam.positions += np.random.RandomState(0).normal(
+            scale=0.1, size=seam.positions.shape)
+        self.overlapping += seam
+
+    def time_relax(self, num_atoms):
+        atoms2d.relax(self.sheet.copy(), self.lat_const, steps=10)
+
+    def peakmem_relax(self, num_atoms):
+        atoms2d.relax(self.sheet.copy(), self.lat_const, steps=10)
+
+    def time_replace_overlaps(self, num_atoms):
+        self.overlapping.copy().replace_overlaps(self.gb_loc)
+
+    def time_remove_atoms(self, num_atoms):
+        self.sheet.copy().remove_atoms(-9999, self.gb_loc)
+
+    def time_remove_regions(self, num_atoms):
+        width = self.sheet.cell[0][0]
+        self.sheet.copy().remove_regions(slabs=[
+            (-9999, width / 4, 'x'), (3 * width / 4, 9999, 'x'),
+            (-9999, width / 4, 'y'), (3 * width / 4, 9999, 'y'),
+        ])
+
+
+class Import:
+    """Import time in a fresh interpreter, which should stay low since the
+    submodules and their dependencies are imported lazily."""
+    def timeraw_import(self):
+        return 'import atoms2d'
+
+    def timeraw_import_atoms(self):
+        return 'from atoms2d import Atoms'
+
+    def timeraw_import_relax(self):
+        return 'from atoms2d import relax'
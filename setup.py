@@ -9,18 +9,23 @@ setup(name='atoms2d',
       license='MIT',
       packages=['atoms2d'],
       zip_safe=False,
+      python_requires='>=3.8',
       install_requires=[
           'ase',
-          'networkx'
+          'scipy'
       ],
+      extras_require={
+          'numba': ['numba'],
+      },
       classifiers=[
           'Intended Audience :: Developers',
           'License :: OSI Approved :: MIT License',
           'Programming Language :: Python',
-          'Programming Language :: Python :: 2.7',
           'Programming Language :: Python :: 3',
-          'Programming Language :: Python :: 3.3',
-          'Programming Language :: Python :: 3.4',
-          'Programming Language :: Python :: 3.5',
-          'Programming Language :: Python :: 3.6',
+          'Programming Language :: Python :: 3 :: Only',
+          'Programming Language :: Python :: 3.8',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
+          'Programming Language :: Python :: 3.12',
       ])
@@ -0,0 +1,86 @@
+"""Deferred transforms must be invisible to anything reading the atoms."""
+import pickle
+
+import numpy as np
+
+import atoms2d
+
+
+def structure():
+    """Return a small structure with random positions."""
+    positions = np.random.RandomState(0).uniform(0, 10, size=(18, 3))
+
+    return atoms2d.Atoms('MoS2' * 3 + 'WSe2' * 3, positions=positions,
+                         cell=[10, 10, 10], lat_const=[3.16, 3.16, 12.29])
+
+
+def transforms(atoms):
+    """Apply a chain of transforms to the atoms."""
+    atoms.rotate(30)
+    atoms.translate([1, -2, 0.5])
+    atoms.reflect(4)
+    atoms.rotate(-75, center=(1, 2, 0))
+    atoms.reflect(1, along='y')
+    atoms.transform(np.diag([1, 1, -1]), [0, 0, 3])
+
+
+def test_deferred_matches_eager():
+    eager = structure()
+    transforms(eager)
+
+    deferred = structure()
+
+    with deferred.deferred():
+        transforms(deferred)
+
+    np.testing.assert_allclose(deferred.positions, eager.positions,
+                               atol=1e-12)
+    np.testing.assert_allclose(deferred.cell[:], eager.cell[:])
+
+
+def test_reads_apply_pending_transform():
+    expected = structure()
+    expected.translate([1, 2, 3])
+    atoms = structure()
+
+    with atoms.deferred():
+        atoms.translate([1, 2, 3])
+        np.testing.assert_allclose(atoms.positions, expected.positions)
+
+    with atoms.deferred():
+        atoms.translate([1, 0, 0])
+        assert len(atoms[:5]) == 5
+        np.testing.assert_allclose(atoms[:5].positions,
+                                   expected.positions[:5] + [1, 0, 0])
+
+    with atoms.deferred():
+        atoms.translate([-1, 0, 0])
+        atoms.extend(structure()[:2])
+        assert len(atoms) == 20
+        np.testing.assert_allclose(atoms.positions[:18], expected.positions)
+
+    with atoms.deferred():
+        atoms.translate([5, 5, 5])
+        atoms.set_positions(expected.positions[:2].repeat(10, axis=0))
+
+    np.testing.assert_allclose(atoms.positions,
+                               expected.positions[:2].repeat(10, axis=0))
+
+
+def test_copy_and_pickle_with_pending_transform():
+    expected = structure()
+    transforms(expected)
+
+    for duplicate in [lambda a: a.copy(),
+                      lambda a: pickle.loads(pickle.dumps(a))]:
+        atoms = structure()
+
+        with atoms.deferred():
+            transforms(atoms)
+            other = duplicate(atoms)
+
+        np.testing.assert_allclose(other.positions, expected.positions,
+                                   atol=1e-12)
+        np.testing.assert_allclose(atoms.positions, expected.positions,
+                                   atol=1e-12)
+        assert other.lat_const == [3.16, 3.16, 12.29]
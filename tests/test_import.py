@@ -0,0 +1,53 @@
+"""Importing atoms2d must stay cheap, as short-lived workers import it."""
+import os
+import subprocess
+import sys
+
+# Seconds allowed for import atoms2d, far below the time of loading ASE's
+# file formats or SciPy
+IMPORT_TIME = 0.25
+
+HEAVY = ['ase.io', 'scipy', 'networkx']
+
+
+def run(script):
+    """Run a script in a fresh interpreter and return its output lines."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    return subprocess.check_output([sys.executable, '-c', script], env=env,
+                                   universal_newlines=True).splitlines()
+
+
+def test_import_is_lazy():
+    output = run('import sys\n'
+                 'import atoms2d\n'
+                 'for name in {0!r}:\n'
+                 '    print(name in sys.modules)\n'.format(HEAVY))
+
+    assert output == ['False'] * len(HEAVY)
+
+
+def test_import_time():
+    script = ('import time\n'
+              'start = time.perf_counter()\n'
+              'import atoms2d\n'
+              'print(time.perf_counter() - start)\n')
+
+    # The best of a few runs, so a busy machine does not fail the test
+    elapsed = min(float(run(script)[0]) for _ in range(3))
+
+    assert elapsed < IMPORT_TIME
+
+
+def test_star_import():
+    output = run('import sys\n'
+                 'from atoms2d import *\n'
+                 'names = [k for k in dir() if k[0] != "_" and k != "sys"]\n'
+                 'print(sorted(names))\n'
+                 'print("multiprocessing.shared_memory" in sys.modules)\n')
+
+    assert output == [repr(['Atoms', 'dislocation', 'gb', 'io', 'read',
+                            'relax']), 'False']
@@ -0,0 +1,45 @@
+"""The Numba backend must give the same results as the NumPy one."""
+import numpy as np
+import pytest
+
+import atoms2d
+from atoms2d import kernels
+
+pytest.importorskip('numba')
+
+
+def sheet(rows=12, columns=12, lat_const=3.16):
+    """Return a jittered triangular sheet of atoms."""
+    i, j = np.meshgrid(np.arange(columns), np.arange(rows), indexing='ij')
+    positions = np.zeros((i.size, 3))
+    positions[:, 0] = lat_const * (i.ravel() + 0.5 * (j.ravel() % 2))
+    positions[:, 1] = lat_const * np.sqrt(3) / 2 * j.ravel()
+    positions[:, :2] += np.random.RandomState(0).normal(
+        scale=0.1, size=(i.size, 2))
+
+    return atoms2d.Atoms('Mo' * i.size, positions=positions)
+
+
+@pytest.mark.parametrize('cutoff', [1.0, 4.74, 10.0])
+def test_pairs_within(cutoff):
+    positions = sheet().positions
+
+    pairs = {}
+
+    for backend in ['numpy', 'numba']:
+        i, j = kernels.pairs_within(positions, cutoff, backend)
+        pairs[backend] = set(zip(i.tolist(), j.tolist()))
+
+    assert pairs['numpy'] == pairs['numba']
+
+
+@pytest.mark.parametrize('method', ['jacobi', 'chebyshev'])
+def test_relax(method):
+    positions = {}
+
+    for backend in ['numpy', 'numba']:
+        atoms = atoms2d.relax(sheet(), 3.16, steps=20, method=method,
+                              backend=backend)
+        positions[backend] = atoms.positions
+
+    np.testing.assert_array_equal(positions['numpy'], positions['numba'])